@@ -1,5 +1,9 @@
+from functools import partial
+
 from django.contrib.auth.models import User
 from django.contrib.humanize.templatetags.humanize import naturaltime
+from django.db.models import Manager
+from django.utils.functional import cached_property
 from drf_queryfields import QueryFieldsMixin
 from rest_framework import serializers
 
@@ -8,8 +12,70 @@ from elvanto.models import ElvantoGroup
 from site_config.models import DefaultResponses, SiteConfiguration
 
 
+def read_column(source, to_representation, row):
+    """Read and convert a column of a row from `.values()`."""
+    value = row[source]
+    return None if value is None else to_representation(value)
+
+
 class BaseModelSerializer(QueryFieldsMixin, serializers.ModelSerializer):
-    pass
+    """
+    Model serializer that can leave out fields (see `QueryFieldsMixin`).
+
+    Only the columns needed by the fields that are left are loaded (see
+    `columns`), and long lists can be serialized straight from the rows
+    of `.values()` (see `value_columns`).
+
+    Fields that are not model fields list the columns they read in
+    `Meta.field_columns`. To serialize a row from `.values()`, they also
+    need a `row_<field name>` method.
+    """
+
+    def columns(self):
+        """Names of the model fields the selected fields read, or None if we cannot tell."""
+        model = self.Meta.model
+        model_fields = {f.name for f in model._meta.concrete_fields} | {f.name for f in model._meta.many_to_many}
+        field_columns = getattr(self.Meta, "field_columns", {})
+        columns = set()
+        for name, field in self.fields.items():
+            if name in field_columns:
+                columns.update(field_columns[name])
+            elif field.source in model_fields or field.source == "pk":
+                columns.add(field.source)
+            else:
+                return None
+        return columns
+
+    def value_columns(self):
+        """Columns to fetch with `.values()` for the selected fields, or None if a field needs the model instance."""
+        plain = {f.name for f in self.Meta.model._meta.concrete_fields if not f.is_relation} | {"pk"}
+        field_columns = getattr(self.Meta, "field_columns", {})
+        columns = []
+        for name, field in self.fields.items():
+            if hasattr(self, "row_" + name):
+                columns.extend(field_columns.get(name, ()))
+            elif field.source in plain:
+                columns.append(field.source)
+            else:
+                return None
+        # keep the order, drop repeats:
+        return list(dict.fromkeys(columns))
+
+    @cached_property
+    def _row_readers(self):
+        readers = []
+        for name, field in self.fields.items():
+            reader = getattr(self, "row_" + name, None)
+            if reader is None:
+                reader = partial(read_column, field.source, field.to_representation)
+            readers.append((name, reader))
+        return readers
+
+    def to_representation(self, instance):
+        if isinstance(instance, dict):
+            # a row from `.values()`:
+            return {name: read(instance) for name, read in self._row_readers}
+        return super(BaseModelSerializer, self).to_representation(instance)
 
 
 class ElvantoGroupSerializer(BaseModelSerializer):
@@ -73,6 +139,26 @@ class SmsInboundSerializer(BaseModelSerializer):
             "matched_colour",
             "sender_pk",
         )
+        field_columns = {"sender_pk": ("_sender_pk",)}
+
+    def row_sender_pk(self, row):
+        # looked up with the message, see `SmsInbound.annotate_sender_pk`:
+        return row["_sender_pk"]
+
+
+class RecipientListSerializer(serializers.ListSerializer):
+    """Serialize many recipients, looking up all their last messages at once."""
+
+    def to_representation(self, data):
+        if "last_sms" in self.child.fields:
+            data = list(data.all() if isinstance(data, Manager) else data)
+            if data and isinstance(data[0], dict):
+                last_sms = Recipient.fetch_last_sms_by_number([row["number"] for row in data])
+                for row in data:
+                    row["_last_sms"] = last_sms[str(row["number"])]
+            else:
+                Recipient.prefetch_last_sms(data)
+        return super(RecipientListSerializer, self).to_representation(data)
 
 
 class RecipientSerializer(BaseModelSerializer):
@@ -82,19 +168,32 @@ class RecipientSerializer(BaseModelSerializer):
     notes = serializers.SerializerMethodField()
 
     def get_number(self, obj):
+        return self.row_number({"number": obj.number})
+
+    def get_notes(self, obj):
+        return self.row_notes({"notes": obj.notes})
+
+    def row_number(self, row):
         user = self.context["request"].user
         if user.profile.can_see_contact_nums or user.is_staff:
-            return str(obj.number)
+            return str(row["number"])
 
         return ""
 
-    def get_notes(self, obj):
+    def row_notes(self, row):
         user = self.context["request"].user
         if user.profile.can_see_contact_notes or user.is_staff:
-            return obj.notes
+            return row["notes"]
 
         return ""
 
+    def row_full_name(self, row):
+        return Recipient.format_full_name(row["first_name"], row["last_name"])
+
+    def row_last_sms(self, row):
+        # looked up for the whole list, see `RecipientListSerializer`:
+        return row["_last_sms"]
+
     class Meta:
         model = Recipient
         fields = (
@@ -110,12 +209,20 @@ class RecipientSerializer(BaseModelSerializer):
             "never_contact",
             "last_sms",
         )
+        list_serializer_class = RecipientListSerializer
+        field_columns = {
+            "number": ("number",),
+            "notes": ("notes",),
+            "full_name": ("first_name", "last_name"),
+            "last_sms": ("number",),
+        }
 
 
 class RecipientSimpleSerializer(BaseModelSerializer):
     class Meta:
         model = Recipient
         fields = ("full_name", "pk")
+        field_columns = {"full_name": ("first_name", "last_name")}
 
 
 class SmsOutboundSerializer(BaseModelSerializer):
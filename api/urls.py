@@ -8,6 +8,7 @@ from api import views as v
 from apostello import forms as f
 from apostello import models as m
 from elvanto.models import ElvantoGroup
+from site_config.models import SiteConfiguration
 
 app_name = "api"
 
@@ -20,9 +21,12 @@ urlpatterns = [
             model_class=m.SmsInbound,
             serializer_class=s.SmsInboundSerializer,
             permission_classes=(IsAuthenticated, p.CanSeeIncoming),
+            etag_models=(m.SmsInbound, m.Keyword, m.Recipient),
+            serialize_values=True,
         ),
         name="in_log",
     ),
+    url(r"^v2/sms/wall/$", v.WallFeed.as_view(), name="wall_feed"),
     url(
         r"^v2/sms/out/$",
         v.Collection.as_view(
@@ -30,6 +34,7 @@ urlpatterns = [
             serializer_class=s.SmsOutboundSerializer,
             permission_classes=(IsAuthenticated, p.CanSeeOutgoing),
             related_field="recipient",
+            etag_models=(m.SmsOutbound, m.Recipient),
         ),
         name="out_log",
     ),
@@ -40,6 +45,8 @@ urlpatterns = [
             form_class=f.RecipientForm,
             serializer_class=s.RecipientSerializer,
             permission_classes=(IsAuthenticated, p.CanSeeContactNames),
+            etag_models=(m.Recipient, m.SmsInbound),
+            serialize_values=True,
         ),
         name="recipients",
     ),
@@ -52,6 +59,7 @@ urlpatterns = [
             serializer_class=s.RecipientGroupSerializer,
             permission_classes=(IsAuthenticated, p.CanSeeGroups),
             prefetch_fields=["recipient_set"],
+            etag_models=(m.RecipientGroup, m.Recipient, SiteConfiguration),
         ),
         name="recipient_groups",
     ),
@@ -81,6 +89,8 @@ urlpatterns = [
             serializer_class=s.KeywordSerializer,
             permission_classes=(IsAuthenticated, p.CanSeeKeywords),
             prefetch_fields=["linked_groups", "owners", "subscribed_to_digest"],
+            etag_models=(m.Keyword, m.SmsInbound),
+            etag_max_age=60,
         ),
         name="keywords",
     ),
@@ -112,6 +122,7 @@ urlpatterns = [
         name="users",
     ),
     url(r"^v2/config/$", v.ConfigView.as_view(), name="site_config"),
+    url(r"^v2/metrics/$", v.MetricsView.as_view(), name="metrics"),
     url(r"^v2/responses/$", v.ResponsesView.as_view(), name="default_responses"),
     # simple toggle views:
     url(
@@ -147,6 +158,9 @@ urlpatterns = [
     # action views:
     url(r"^v2/actions/sms/send/adhoc/$", v.SendAdhoc.as_view(), name="act_send_adhoc"),
     url(r"^v2/actions/sms/send/group/$", v.SendGroup.as_view(), name="act_send_group"),
+    url(r"^v2/actions/sms/send/target/$", v.SendTarget.as_view(), name="act_send_target"),
+    url(r"^v2/actions/sms/cost/$", v.SmsCostEstimate.as_view(), name="act_sms_cost_estimate"),
+    url(r"^v2/actions/sms/send/preview/$", v.SendPreview.as_view(), name="act_send_preview"),
     url(
         r"^v2/actions/sms/in/archive/(?P<pk>[0-9]+)/$",
         v.ArchiveObj.as_view(
@@ -1,11 +1,16 @@
 import csv
+import hashlib
 import io
+from time import time
 
 from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import parse_etags
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.views.generic import View
 from django_q.tasks import async_task
 from phonenumber_field.validators import validate_international_phonenumber
@@ -17,14 +22,24 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from api import serializers
-from api.drf_permissions import CanImport, CanSeeKeywords, CanSendSms, IsStaff
+from api.drf_permissions import CanImport, CanSeeIncoming, CanSeeKeywords, CanSendSms, IsStaff
 from api.forms import handle_form
-from apostello.forms import CsvImport, GroupAllCreateForm, SendAdhocRecipientsForm, SendRecipientGroupForm
+from apostello import audience, metrics, sync
+from apostello.forms import (
+    CsvImport,
+    GroupAllCreateForm,
+    SendAdhocRecipientsForm,
+    SendRecipientGroupForm,
+    SendTargetForm,
+    SmsCostEstimateForm,
+)
 from apostello.mixins import ProfilePermsMixin
-from apostello.models import Keyword, Recipient, RecipientGroup, SmsInbound, SmsOutbound
+from apostello.models import Keyword, QueuedSms, Recipient, RecipientGroup, SmsInbound, SmsOutbound, count_sms
+from apostello.segments import measure
+from apostello.versions import get_versions
 from elvanto.models import ElvantoGroup
 from site_config.forms import DefaultResponsesForm, SiteConfigurationForm
-from site_config.models import DefaultResponses, SiteConfiguration
+from site_config.models import ConfigurationError, DefaultResponses, SiteConfiguration
 
 
 class ActionForbidden(Exception):
@@ -54,6 +69,17 @@ class ConfigView(APIView):
         return handle_form(self, request)
 
 
+class MetricsView(APIView):
+    """Latency of the incoming sms webhook, and of checking its signature, today (see `apostello.metrics`)."""
+
+    permission_classes = (IsAuthenticated, IsStaff)
+
+    def get(self, request, format=None, **kwargs):
+        return Response(
+            {"sms_webhook": metrics.summary("sms_webhook"), "twilio_validation": metrics.summary("twilio_validation")}
+        )
+
+
 class ResponsesView(APIView):
     permission_classes = (IsAuthenticated, IsStaff)
     model_class = DefaultResponses
@@ -141,6 +167,32 @@ class SetupView(APIView):
         return Response({"token": str(token)}, status=status.HTTP_200_OK)
 
 
+def etag_matches(etag, if_none_match):
+    """Does `etag` match one of the ETags in an If-None-Match header? ETags are compared weakly."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(strip_weak(e) == strip_weak(etag) for e in parse_etags(if_none_match))
+
+
+def strip_weak(etag):
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def parse_cursor(cursor):
+    """Read a cursor returned by the API. Returns None for a missing or invalid cursor."""
+    if not cursor:
+        return None
+    try:
+        dt = parse_datetime(cursor)
+    except ValueError:
+        return None
+    if dt is not None and timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
 class Collection(generics.ListAPIView):
     """Basic collection view. Check user is authenticated by default."""
 
@@ -151,6 +203,17 @@ class Collection(generics.ListAPIView):
     related_field = None
     prefetch_fields = None
     pagination_class = StandardPagination
+    # serialize the rows from `.values()` rather than model instances, for
+    # long lists (see `api.serializers.BaseModelSerializer`):
+    serialize_values = False
+    # only return changes after this time, see `list_objects`:
+    since = None
+    # models the collection is worked out from, responses get an ETag
+    # built from their version stamps (see `apostello.versions`):
+    etag_models = None
+    # for collections with fields that change with time (e.g. whether a
+    # keyword is live), the number of seconds an ETag stays valid for:
+    etag_max_age = None
 
     def filter_objs(self, objs):
         identifier = self.kwargs.get("pk")
@@ -171,20 +234,111 @@ class Collection(generics.ListAPIView):
     def _get_queryset(self):
         """Handle get requests."""
         objs = self.model_class.objects.all()
-        if self.related_field is not None:
+        # only load what the requested fields need:
+        columns = self.get_serializer().columns()
+        if self.related_field is not None and (columns is None or self.related_field in columns):
             objs = objs.select_related(self.related_field)
         if self.prefetch_fields is not None:
-            objs = objs.prefetch_related(*self.prefetch_fields)
-        if (
+            prefetch = [f for f in self.prefetch_fields if columns is None or f in columns]
+            if prefetch:
+                objs = objs.prefetch_related(*prefetch)
+        if columns is not None:
+            concrete = {f.name for f in self.model_class._meta.concrete_fields} | {"pk"}
+            objs = objs.only(*(columns & concrete or {"pk"}))
+        if self.since is not None:
+            objs = sync.changed(objs, self.since)
+        if self.hides_archived():
+            # filter out archived items
+            objs = objs.filter(is_archived=False)
+
+        return self.filter_objs(objs)
+
+    def hides_archived(self):
+        return (
             not self.request.user.is_staff
             and self.model_class is not SmsInbound
             and self.model_class is not SmsOutbound
             and self.model_class is not ElvantoGroup
-        ):
-            # filter out archived items
-            objs = objs.filter(is_archived=False)
+        )
 
-        return self.filter_objs(objs)
+    def etag(self, request):
+        """
+        Weak ETag for the response, or None if the collection does not have one.
+
+        Built from the version stamps of `etag_models`, what the user is
+        allowed to see and the request, so it can be checked without
+        querying the collection.
+        """
+        if self.etag_models is None:
+            return None
+        user = request.user
+        parts = [
+            request.path,
+            request.accepted_renderer.format,
+            sorted(request.query_params.lists()),
+            user.pk,
+            user.is_staff,
+            [getattr(user.profile, f.attname) for f in user.profile._meta.concrete_fields],
+            get_versions(*self.etag_models),
+        ]
+        if self.etag_max_age is not None:
+            parts.append(int(time() // self.etag_max_age))
+        return 'W/"{0}"'.format(hashlib.md5(repr(parts).encode("utf-8")).hexdigest())
+
+    def list(self, request, *args, **kwargs):
+        """
+        List the collection.
+
+        Responds with 304 Not Modified if the client already has the
+        current version.
+        """
+        etag = self.etag(request)
+        if etag is not None and etag_matches(etag, request.META.get("HTTP_IF_NONE_MATCH")):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = self.list_objects(request, *args, **kwargs)
+        if etag is not None and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response["ETag"] = etag
+            # always check the ETag with us before using a stored copy:
+            response["Cache-Control"] = "private, no-cache"
+        return response
+
+    def list_objects(self, request, *args, **kwargs):
+        """
+        List the objects in the collection.
+
+        With a `since` cursor, only return the objects created, changed or
+        deleted since the cursor was issued, and a new cursor.
+        """
+        cursor = request.query_params.get("since")
+        if not cursor or self.model_class not in sync.SYNCED_MODELS:
+            return self.list_all(request)
+
+        since = parse_cursor(cursor)
+        if since is None or sync.is_expired(since):
+            msg = {"type_": "warning", "text": "This sync cursor is not valid any more, please fetch everything again."}
+            return Response({"messages": [msg], "errors": {}}, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        self.since = since - settings.CURSOR_OVERLAP
+        changed = self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data
+        deleted = sync.deleted(self.model_class, self.since)
+        if self.hides_archived():
+            archived = sync.changed(self.model_class.objects.filter(is_archived=True), self.since)
+            deleted += list(self.filter_objs(archived).values_list("pk", flat=True))
+        return Response({"since": now.isoformat(), "changed": changed, "deleted": deleted})
+
+    def list_all(self, request):
+        """List every object in the collection, a page at a time."""
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.serialize_values:
+            columns = self.get_serializer().value_columns()
+            if columns is not None:
+                queryset = queryset.values(*columns)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(queryset, many=True).data)
 
     def post(self, request, format=None, **kwargs):
         return handle_form(self, request)
@@ -200,14 +354,66 @@ class UserCollection(Collection):
         return self.model_class.objects.all().order_by("email")
 
 
+def visible_sms(user, qs):
+    """Leave out incoming messages that matched keywords `user` cannot access."""
+    if user.is_staff:
+        return qs
+    blocked_keywords = [x.keyword for x in Keyword.objects.all() if not x.can_user_access(user)]
+    return qs.exclude(matched_keyword__in=blocked_keywords)
+
+
 class SmsCollection(Collection):
     def get_queryset(self):
         qs = self._get_queryset()
+        if "sender_pk" in self.get_serializer().fields:
+            qs = SmsInbound.annotate_sender_pk(qs)
         if self.request.user.is_staff:
             return qs
 
-        blocked_keywords = [x.keyword for x in Keyword.objects.all() if not x.can_user_access(self.request.user)]
-        return qs.exclude(matched_keyword__in=blocked_keywords)[0 : settings.MAX_SMS_N]
+        return visible_sms(self.request.user, qs)[0 : settings.MAX_SMS_N]
+
+
+def wall_changes(user, since=None):
+    """
+    Incoming messages for the live wall that changed after the cursor `since`.
+
+    Without a cursor, returns the messages currently on the wall. With one,
+    returns every message changed since, on the wall or not, so clients can
+    also take messages off the wall. Returns the serialized messages and
+    the cursor to use next time.
+
+    At most `settings.MAX_SMS_N` messages are returned, oldest change
+    first. If there are more, the cursor is the last message's change, so
+    the next request picks up the rest.
+    """
+    now = timezone.now()
+    messages = SmsInbound.objects.all()
+    if since is None:
+        messages = messages.filter(display_on_wall=True, is_archived=False)
+    else:
+        # overlap a little, in case a message was saved with an earlier
+        # timestamp but committed after our last look:
+        messages = messages.filter(updated_at__gt=since - settings.CURSOR_OVERLAP)
+    messages = visible_sms(user, messages).order_by("updated_at", "pk")
+    messages = list(SmsInbound.annotate_sender_pk(messages)[0 : settings.MAX_SMS_N])
+    cursor = messages[-1].updated_at if len(messages) == settings.MAX_SMS_N else now
+    data = serializers.SmsInboundSerializer(messages, many=True).data
+    return data, cursor.isoformat()
+
+
+class WallFeed(APIView):
+    """
+    Changes to the live wall since a cursor.
+
+    Clients keep the cursor from each response and pass it back as `since`
+    to get only what has changed.
+    """
+
+    permission_classes = (IsAuthenticated, CanSeeIncoming)
+
+    def get(self, request, format=None, **kwargs):
+        data, cursor = wall_changes(request.user, parse_cursor(request.query_params.get("since")))
+        return Response({"cursor": cursor, "messages": data})
 
 
 class QueuedSmsCollection(Collection):
@@ -388,6 +594,15 @@ class ArchiveAllResponses(APIView):
         return Response({}, status=status.HTTP_200_OK)
 
 
+def _skipped_text(skipped):
+    """Explain who will not be sent a message (see `apostello.audience.skipped_counts`)."""
+    if not any(skipped.values()):
+        return ""
+    return "\n{0} archived, {1} blocking and {2} 'never contact' contacts will be skipped.".format(
+        skipped[audience.ARCHIVED], skipped[audience.BLOCKING], skipped[audience.NEVER_CONTACT]
+    )
+
+
 class SendAdhoc(APIView):
     """Send SMS to individuals."""
 
@@ -396,12 +611,18 @@ class SendAdhoc(APIView):
     def post(self, request, format=None, **kwargs):
         form = SendAdhocRecipientsForm(request.data, user=request.user)
         if form.is_valid():
-            for recipient in form.cleaned_data["recipients"]:
-                # send and save message
-                recipient.send_message(
-                    content=form.cleaned_data["content"],
-                    eta=form.cleaned_data["scheduled_time"],
-                    sent_by=str(self.request.user),
+            skipped = audience.skipped_counts(form.cleaned_data["recipients"])
+            recipients = audience.sendable(form.cleaned_data["recipients"])
+            if form.cleaned_data["scheduled_time"] is None:
+                for recipient in recipients:
+                    # send and save message
+                    recipient.send_message(content=form.cleaned_data["content"], sent_by=str(self.request.user))
+            else:
+                QueuedSms.schedule(
+                    recipients,
+                    form.cleaned_data["content"],
+                    str(self.request.user),
+                    form.cleaned_data["scheduled_time"],
                 )
 
             if form.cleaned_data["scheduled_time"] is None:
@@ -414,6 +635,7 @@ class SendAdhoc(APIView):
                     "type_": "info",
                     "text": "'{0}' has been successfully queued.".format(form.cleaned_data["content"]),
                 }
+            msg["text"] += _skipped_text(skipped)
             return Response({"messages": [msg], "errors": {}}, status=status.HTTP_201_CREATED)
 
         return Response({"messages": [], "errors": form.errors}, status=status.HTTP_400_BAD_REQUEST)
@@ -427,6 +649,7 @@ class SendGroup(APIView):
     def post(self, request, format=None, **kwargs):
         form = SendRecipientGroupForm(request.data, user=request.user)
         if form.is_valid():
+            skipped = audience.skipped_counts(form.cleaned_data["recipient_group"].recipient_set.all())
             form.cleaned_data["recipient_group"].send_message(
                 content=form.cleaned_data["content"],
                 eta=form.cleaned_data["scheduled_time"],
@@ -442,12 +665,111 @@ class SendGroup(APIView):
                     "type_": "info",
                     "text": "'{0}' has been successfully queued.".format(form.cleaned_data["content"]),
                 }
+            msg["text"] += _skipped_text(skipped)
 
             return Response({"messages": [msg], "errors": {}}, status=status.HTTP_201_CREATED)
 
         return Response({"messages": [], "errors": form.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class SendTarget(APIView):
+    """Send SMS to a combination of groups."""
+
+    permission_classes = (IsAuthenticated, CanSendSms)
+
+    def post(self, request, format=None, **kwargs):
+        form = SendTargetForm(request.data, user=request.user)
+        if form.is_valid():
+            target = form.target()
+            skipped = audience.skipped_counts(audience.target(**target))
+            async_task(
+                "apostello.tasks.target_send_message_task",
+                form.cleaned_data["content"],
+                target,
+                str(self.request.user),
+                form.cleaned_data["scheduled_time"],
+            )
+            if form.cleaned_data["scheduled_time"] is None:
+                msg_txt = 'Sending "{0}"...\nPlease check the logs for verification...'.format(
+                    form.cleaned_data["content"]
+                )
+                msg = {"type_": "info", "text": msg_txt}
+            else:
+                msg = {
+                    "type_": "info",
+                    "text": "'{0}' has been successfully queued.".format(form.cleaned_data["content"]),
+                }
+            msg["text"] += _skipped_text(skipped)
+            return Response({"messages": [msg], "errors": {}}, status=status.HTTP_201_CREATED)
+
+        return Response({"messages": [], "errors": form.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _send_target(form):
+    """Recipients queryset and group name (if any) chosen in a valid SmsCostEstimateForm."""
+    group = form.cleaned_data["recipient_group"]
+    if group is not None:
+        return group.recipient_set.all(), group.name
+    return form.cleaned_data["recipients"], None
+
+
+class SmsCostEstimate(APIView):
+    """Estimate the cost of sending an SMS, without sending it."""
+
+    permission_classes = (IsAuthenticated, CanSendSms)
+
+    def post(self, request, format=None, **kwargs):
+        form = SmsCostEstimateForm(request.data)
+        if not form.is_valid():
+            return Response({"messages": [], "errors": form.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        content = form.cleaned_data["content"]
+        recipients, group_name = _send_target(form)
+        target = audience.resolve(recipients)
+        length = measure(content)
+        num_sms = count_sms(content, target.recipients, group=group_name)
+        try:
+            cost = SiteConfiguration.get_twilio_settings()["sending_cost"] * num_sms
+        except ConfigurationError:
+            cost = None
+        return Response(
+            {
+                "encoding": length.encoding,
+                "characters": length.characters,
+                "segments": length.segments,
+                "recipients": len(target.recipients),
+                "skipped": target.skipped,
+                "sms": num_sms,
+                "cost": cost,
+            }
+        )
+
+
+class SendPreview(APIView):
+    """
+    Dry run of sending an SMS.
+
+    Shows who will receive the message, what it will say and what it will
+    cost, without sending anything.
+    """
+
+    permission_classes = (IsAuthenticated, CanSendSms)
+
+    def post(self, request, format=None, **kwargs):
+        form = SmsCostEstimateForm(request.data)
+        if not form.is_valid():
+            return Response({"messages": [], "errors": form.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        recipients, group_name = _send_target(form)
+        preview = audience.preview(form.cleaned_data["content"], recipients, group=group_name)
+        if not request.user.profile.can_see_contact_names:
+            # personalised messages give names away too:
+            preview["recipients"] = [
+                {k: v for k, v in r.items() if k not in ("full_name", "content")} for r in preview["recipients"]
+            ]
+        return Response(preview)
+
+
 class CreateAllGroup(APIView):
     """View to handle creation of an 'all' group."""
 
@@ -57,6 +57,22 @@ class RecipientGroupAdmin(admin.ModelAdmin):
     list_display = ("name", "description", "is_archived")
 
 
+@admin.register(models.QueuedSmsHistory)
+class QueuedSmsHistoryAdmin(admin.ModelAdmin):
+    """Admin class for apostello.models.QueuedSmsHistory."""
+
+    list_display = ("time_to_send", "sent", "failed", "content", "sent_by", "recipient_group", "recipient")
+    list_filter = ("sent", "failed")
+
+
+@admin.register(models.DailySmsStats)
+class DailySmsStatsAdmin(admin.ModelAdmin):
+    """Admin class for apostello.models.DailySmsStats."""
+
+    list_display = ("day", "direction", "dimension", "value", "count")
+    list_filter = ("direction", "dimension")
+
+
 admin.site.unregister(User)
 
 
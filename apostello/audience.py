@@ -0,0 +1,117 @@
+"""
+Work out who a message will actually be sent to.
+
+Archived contacts, contacts who have blocked us and contacts marked as
+"never contact" are skipped when sending. They are filtered out in the
+database before any work is queued for them, and counted by the reason
+they were skipped.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from apostello import segments
+from site_config.models import ConfigurationError, SiteConfiguration
+
+ARCHIVED = "archived"
+BLOCKING = "blocking"
+NEVER_CONTACT = "never_contact"
+
+Audience = namedtuple("Audience", ["recipients", "skipped"])
+
+
+def sendable(recipients):
+    """Leave out recipients that would be skipped, and anyone listed twice (e.g. in two groups)."""
+    return recipients.filter(is_archived=False, is_blocking=False, never_contact=False).distinct()
+
+
+def skipped_counts(recipients):
+    """Count the recipients that would be skipped, by reason, with a single aggregate query."""
+    archived = Q(is_archived=True)
+    blocking = Q(is_archived=False, is_blocking=True)
+    never_contact = Q(is_archived=False, is_blocking=False, never_contact=True)
+    return recipients.aggregate(
+        **{
+            ARCHIVED: Count("pk", filter=archived, distinct=True),
+            BLOCKING: Count("pk", filter=blocking, distinct=True),
+            NEVER_CONTACT: Count("pk", filter=never_contact, distinct=True),
+        }
+    )
+
+
+def target(groups, require=(), exclude=(), exclude_do_not_reply=False):
+    """
+    Recipients in a set of groups.
+
+    Picks everyone in any of `groups`, who is also in every group in
+    `require` and in none of the groups in `exclude` (all given as group
+    pks). Each term is a subquery on group membership, so the whole target
+    is fetched with a single query.
+    """
+    from apostello.models import Recipient
+
+    membership = Recipient.groups.through.objects
+
+    def members(group_pks, **kwargs):
+        return Q(pk__in=membership.filter(recipientgroup_id__in=group_pks, **kwargs).values("recipient_id"))
+
+    # archived groups don't send messages:
+    q = members(groups, recipientgroup__is_archived=False)
+    for pk in require:
+        q &= members([pk], recipientgroup__is_archived=False)
+    if exclude:
+        q &= ~members(exclude)
+    if exclude_do_not_reply:
+        q &= Q(do_not_reply=False)
+    return Recipient.objects.filter(q)
+
+
+def resolve(recipients):
+    """
+    Split a queryset of recipients into an Audience.
+
+    `Audience.recipients` is the list of recipients that will be sent the
+    message and `Audience.skipped` counts the rest by skip reason.
+    """
+    audience = list(sendable(recipients).only("first_name", "last_name", "number"))
+    return Audience(audience, skipped_counts(recipients))
+
+
+def preview(content, recipients, group=None):
+    """
+    Dry run of sending `content` to a queryset of recipients.
+
+    Every message is personalised and measured, nothing is sent. Returns a
+    per recipient breakdown, along with the total number of sms, cost and
+    how long Twilio will take to send them (at TWILIO_SEND_RATE).
+    """
+    try:
+        sending_cost = SiteConfiguration.get_twilio_settings()["sending_cost"]
+    except ConfigurationError:
+        sending_cost = None
+
+    audience = resolve(recipients)
+    breakdown = []
+    for recipient in audience.recipients:
+        body = recipient.personalise(content, group=group or "")
+        length = segments.measure(body)
+        breakdown.append(
+            {
+                "pk": recipient.pk,
+                "full_name": recipient.full_name,
+                "content": body,
+                "encoding": length.encoding,
+                "segments": length.segments,
+                "cost": None if sending_cost is None else sending_cost * length.segments,
+            }
+        )
+
+    num_sms = sum(r["segments"] for r in breakdown)
+    return {
+        "recipients": breakdown,
+        "skipped": audience.skipped,
+        "sms": num_sms,
+        "cost": None if sending_cost is None else sending_cost * num_sms,
+        "estimated_duration": num_sms / settings.TWILIO_SEND_RATE,
+    }
@@ -2,6 +2,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.forms import ModelMultipleChoiceField
 
+from apostello import audience
 from apostello.models import Keyword, Recipient, RecipientGroup, UserProfile
 from apostello.validators import gsm_validator, less_than_sms_char_limit
 import allauth.account.forms
@@ -66,6 +67,71 @@ class SendRecipientGroupForm(forms.Form):
         super(SendRecipientGroupForm, self).__init__(*args, **kwargs)
 
 
+class SendTargetForm(forms.Form):
+    """Send an sms to a combination of groups."""
+
+    content = forms.CharField(validators=[gsm_validator, less_than_sms_char_limit], required=True, min_length=1)
+    groups = forms.ModelMultipleChoiceField(
+        queryset=RecipientGroup.objects.filter(is_archived=False),
+        required=True,
+        help_text="Send to anyone in any of these groups...",
+    )
+    require_groups = forms.ModelMultipleChoiceField(
+        queryset=RecipientGroup.objects.filter(is_archived=False),
+        required=False,
+        help_text="...who is also in all of these groups...",
+    )
+    exclude_groups = forms.ModelMultipleChoiceField(
+        queryset=RecipientGroup.objects.filter(is_archived=False),
+        required=False,
+        help_text="...and is not in any of these groups.",
+    )
+    exclude_do_not_reply = forms.BooleanField(required=False, label="Skip people with automated replies turned off")
+    scheduled_time = forms.DateTimeField(
+        required=False,
+        help_text="Leave this blank to send your message immediately, "
+        "otherwise select a date and time to schedule your message",
+        label="Scheduled Time",
+    )
+
+    def target(self):
+        """Arguments for `apostello.audience.target`."""
+        return {
+            "groups": [g.pk for g in self.cleaned_data["groups"]],
+            "require": [g.pk for g in self.cleaned_data["require_groups"]],
+            "exclude": [g.pk for g in self.cleaned_data["exclude_groups"]],
+            "exclude_do_not_reply": self.cleaned_data["exclude_do_not_reply"],
+        }
+
+    def clean(self):
+        """Override clean method to check SMS cost limit."""
+        cleaned_data = super(SendTargetForm, self).clean()
+        if "groups" in cleaned_data and "content" in cleaned_data:
+            Recipient.check_user_cost_limit(
+                audience.target(**self.target()), self.user.profile.message_cost_limit, cleaned_data["content"]
+            )
+        return cleaned_data
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop("user", None)
+        super(SendTargetForm, self).__init__(*args, **kwargs)
+
+
+class SmsCostEstimateForm(forms.Form):
+    """Estimate the cost of sending an sms to individuals or a group."""
+
+    content = forms.CharField(required=True, min_length=1)
+    recipients = forms.ModelMultipleChoiceField(queryset=Recipient.objects.filter(is_archived=False), required=False)
+    recipient_group = forms.ModelChoiceField(queryset=RecipientGroup.objects.filter(is_archived=False), required=False)
+
+    def clean(self):
+        """Override clean method to require some recipients."""
+        cleaned_data = super(SmsCostEstimateForm, self).clean()
+        if not cleaned_data.get("recipients") and not cleaned_data.get("recipient_group"):
+            raise ValidationError("Choose some recipients or a group.")
+        return cleaned_data
+
+
 class ManageRecipientGroupForm(forms.ModelForm):
     """
     Manage RecipientGroup updates and creation.
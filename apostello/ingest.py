@@ -0,0 +1,96 @@
+"""
+Buffered logging of incoming messages.
+
+During a busy event, writing every incoming message to the database as
+it arrives (and refreshing the caches that depend on it) is a lot of
+work for the database. With `settings.SMS_BUFFERED_INGEST` turned on,
+incoming messages are appended to a list in Redis instead, and
+`drain_buffer` writes them to the database in batches, refreshing the
+caches once per batch.
+
+Messages are only removed from the buffer once they have been written,
+and messages that are already in the database are skipped, so a drain
+that is interrupted can be run again safely.
+"""
+import json
+import logging
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+from django_q.tasks import async_task
+from django_redis import get_redis_connection
+
+from apostello.models import Recipient, SmsInbound
+from apostello.versions import bump_version
+
+logger = logging.getLogger("apostello")
+
+BUFFER_KEY = "inbound_sms_buffer"
+BATCH_SIZE = 500
+# at most one drain is queued in this many seconds:
+DRAIN_INTERVAL = 5
+
+
+def buffer_sms(**fields):
+    """Add an incoming message (the fields of an SmsInbound) to the buffer, and make sure it is drained soon."""
+    get_redis_connection("default").rpush(BUFFER_KEY, json.dumps(fields, cls=DjangoJSONEncoder))
+    if cache.add("inbound_sms_drain_queued", True, DRAIN_INTERVAL):
+        async_task("apostello.tasks.drain_inbound_buffer")
+
+
+def buffered_count():
+    """Number of messages waiting in the buffer."""
+    return get_redis_connection("default").llen(BUFFER_KEY)
+
+
+def write_batch(rows):
+    """
+    Write a batch of buffered messages to the database.
+
+    Returns the number of messages written.
+    """
+    seen = set(SmsInbound.objects.filter(sid__in=[r["sid"] for r in rows]).values_list("sid", flat=True))
+    new = []
+    for row in rows:
+        if row["sid"] in seen:
+            continue
+        seen.add(row["sid"])
+        row["time_received"] = parse_datetime(row["time_received"])
+        new.append(SmsInbound(**row))
+    if not new:
+        return 0
+
+    SmsInbound.objects.bulk_create(new)
+    # bulk_create skips SmsInbound.save and the post_save signal, so refresh everything once for the batch:
+    bump_version(SmsInbound)
+    Recipient.cache_last_sms_many(new)
+    async_task("apostello.tasks.populate_keyword_response_count")
+    return len(new)
+
+
+def drain_buffer(batch_size=BATCH_SIZE):
+    """
+    Write buffered messages to the database until the buffer is empty.
+
+    Only one drain runs at a time. Returns the number of messages written.
+    """
+    if not cache.add("inbound_sms_draining", True, 5 * 60):
+        return 0
+    conn = get_redis_connection("default")
+    written = 0
+    try:
+        while True:
+            raw = conn.lrange(BUFFER_KEY, 0, batch_size - 1)
+            if not raw:
+                break
+            written += write_batch([json.loads(r.decode("utf-8")) for r in raw])
+            conn.ltrim(BUFFER_KEY, len(raw), -1)
+    finally:
+        cache.delete("inbound_sms_draining")
+
+    if written:
+        logger.info("Wrote %s buffered incoming messages", written)
+        # check log is consistent:
+        async_task("apostello.tasks.check_incoming_log")
+    return written
@@ -1,23 +1,35 @@
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
+from time import monotonic
 
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.timezone import utc
+from django_q.tasks import async_task
 from twilio.base.exceptions import TwilioRestException
 
 from site_config.models import SiteConfiguration
 
-from .models import Keyword, Recipient, SmsInbound, SmsOutbound
+from .models import DailySmsStats, Keyword, Recipient, SmsInbound, SmsOutbound, Tombstone
 from .twilio import get_twilio_client
+from .versions import bump_version
 
 logger = logging.getLogger("apostello")
 
+# expired message cleanup, see `cleanup_expired_sms`:
+CLEANUP_CHUNK_SIZE = 1000
+CLEANUP_MIN_CHUNK_SIZE = 100
+CLEANUP_MAX_CHUNK_SIZE = 10000
+CLEANUP_CHUNK_SECONDS = 1
+CLEANUP_TIME_BUDGET = 60
 
-def has_expired(dt_):
-    d = get_expiry_date()
-    if d is None:
+
+def has_expired(dt_, cutoff):
+    """Check if a message sent or received at `dt_` is older than `cutoff` (see `expiry_cutoff`)."""
+    if cutoff is None:
         return False
-    else:
-        return dt_.date() < d
+    return dt_ < cutoff
 
 
 def get_expiry_date():
@@ -46,17 +58,83 @@ def get_expiry_date():
     return delete_date
 
 
-def cleanup_expired_sms():
-    """Remove expired messages."""
+def expiry_cutoff():
+    """Start of the expiry date as an aware datetime, or None if messages do not expire."""
     d = get_expiry_date()
-    if d is not None:
-        SmsInbound.objects.filter(time_received__date__lt=d).delete()
-        SmsOutbound.objects.filter(time_sent__date__lt=d).delete()
+    if d is None:
+        return None
+    return timezone.make_aware(datetime.combine(d, time.min), timezone.get_current_timezone())
+
+
+def delete_in_chunks(queryset, deadline):
+    """
+    Delete the rows of `queryset` in chunks of consecutive primary keys.
+
+    Each chunk is removed with a single bulk DELETE that bypasses the ORM
+    delete collector, so no rows are loaded and no signals are sent. The chunk
+    size adapts to keep each DELETE within CLEANUP_CHUNK_SECONDS.
+
+    Returns the number of rows deleted and whether the queryset is now empty.
+    Stops early if `deadline` (a `monotonic` time) passes.
+    """
+    queryset = queryset.order_by("pk")
+    chunk_size = CLEANUP_CHUNK_SIZE
+    deleted = 0
+    while monotonic() < deadline:
+        pks = list(queryset.values_list("pk", flat=True)[:chunk_size])
+        if not pks:
+            return deleted, True
+        chunk = queryset.filter(pk__gte=pks[0], pk__lte=pks[-1])
+        started = monotonic()
+        with transaction.atomic():
+            deleted += chunk._raw_delete(chunk.db)
+            # raw deletes do not send signals, so record the tombstones here:
+            Tombstone.record(queryset.model, pks)
+        took = monotonic() - started
+        if took > CLEANUP_CHUNK_SECONDS:
+            chunk_size = max(CLEANUP_MIN_CHUNK_SIZE, chunk_size // 2)
+        elif took < CLEANUP_CHUNK_SECONDS / 4:
+            chunk_size = min(CLEANUP_MAX_CHUNK_SIZE, chunk_size * 2)
+        logger.info("Deleted %s expired %s so far", deleted, queryset.model._meta.verbose_name_plural)
+    return deleted, False
+
 
+def cleanup_expired_sms():
+    """
+    Remove expired messages.
+
+    Stops after CLEANUP_TIME_BUDGET seconds and queues another run to carry
+    on, so a large backlog of expired messages never holds the tables for
+    long.
+    """
+    cutoff = expiry_cutoff()
+    if cutoff is None:
+        return
+
+    deadline = monotonic() + CLEANUP_TIME_BUDGET
+    finished = True
+    for queryset in (
+        SmsInbound.objects.filter(time_received__lt=cutoff),
+        SmsOutbound.objects.filter(time_sent__lt=cutoff),
+    ):
+        deleted, done = delete_in_chunks(queryset, deadline)
+        if deleted:
+            # raw deletes do not send signals:
+            bump_version(queryset.model)
+        finished = finished and done
+
+    if not finished:
+        logger.info("Expired message cleanup ran out of time, queuing another run")
+        async_task("apostello.tasks.cleanup_expired_sms")
+        return
 
-def handle_incoming_sms(msg):
-    """Add incoming sms to log."""
-    if has_expired(msg.date_created):
+    DailySmsStats.objects.filter(day__lt=timezone.localdate(cutoff)).delete()
+    logger.info("Expired message cleanup finished")
+
+
+def handle_incoming_sms(msg, cutoff=None):
+    """Add incoming sms to log, unless it was received before `cutoff`."""
+    if has_expired(msg.date_created, cutoff):
         return
     sms, created = SmsInbound.objects.get_or_create(sid=msg.sid)
     if created:
@@ -76,9 +154,9 @@ def handle_incoming_sms(msg):
         sms.save()
 
 
-def handle_outgoing_sms(msg):
-    """Add outgoing sms to log."""
-    if has_expired(msg.date_sent):
+def handle_outgoing_sms(msg, cutoff=None):
+    """Add outgoing sms to log, unless it was sent before `cutoff`."""
+    if has_expired(msg.date_sent, cutoff):
         return
     try:
         sms, created = SmsOutbound.objects.get_or_create(sid=msg.sid)
@@ -99,13 +177,21 @@ def handle_outgoing_sms(msg):
         logger.error("Could not import sms.", exc_info=True, extra={"msg": msg})
 
 
-def fetch_generator(direction):
-    """Fetch generator from twilio."""
+def fetch_generator(direction, cutoff=None):
+    """
+    Fetch generator from twilio.
+
+    If a `cutoff` is given, Twilio is asked to leave out messages sent before
+    it, so pages of expired messages are never fetched.
+    """
     twilio_num = str(SiteConfiguration.get_solo().twilio_from_num)
+    filters = {}
+    if cutoff is not None:
+        filters["date_sent_after"] = cutoff.astimezone(utc)
     if direction == "in":
-        return get_twilio_client().messages.list(to=twilio_num)
+        return get_twilio_client().messages.list(to=twilio_num, **filters)
     if direction == "out":
-        return get_twilio_client().messages.list(from_=twilio_num)
+        return get_twilio_client().messages.list(from_=twilio_num, **filters)
     return []
 
 
@@ -116,11 +202,14 @@ def check_log(direction):
     elif direction == "out":
         sms_handler = handle_outgoing_sms
 
+    # look up the expiry settings once for the whole import:
+    cutoff = expiry_cutoff()
+
     # we want to iterate over all the incoming messages
-    sms_page = fetch_generator(direction)
+    sms_page = fetch_generator(direction, cutoff)
 
     for msg in sms_page:
-        sms_handler(msg)
+        sms_handler(msg, cutoff)
 
 
 def check_incoming_log():
@@ -30,6 +30,19 @@ class Command(BaseCommand):
         if Schedule.objects.filter(func="apostello.tasks.send_queued_sms").count() < 1:
             Schedule.objects.create(func="apostello.tasks.send_queued_sms", schedule_type=Schedule.MINUTES, minutes=1)
 
+        if Schedule.objects.filter(func="apostello.tasks.drain_inbound_buffer").count() < 1:
+            Schedule.objects.create(
+                func="apostello.tasks.drain_inbound_buffer", schedule_type=Schedule.MINUTES, minutes=1
+            )
+
+        if Schedule.objects.filter(func="apostello.tasks.render_graphs").count() < 1:
+            Schedule.objects.create(func="apostello.tasks.render_graphs", schedule_type=Schedule.MINUTES, minutes=5)
+
+        if Schedule.objects.filter(func="apostello.tasks.update_daily_stats").count() < 1:
+            Schedule.objects.create(
+                func="apostello.tasks.update_daily_stats", schedule_type=Schedule.HOURLY, repeats=-1
+            )
+
         if Schedule.objects.filter(func="apostello.tasks.pull_elvanto_groups").count() < 1:
             Schedule.objects.create(
                 func="apostello.tasks.pull_elvanto_groups", schedule_type=Schedule.DAILY, repeats=-1, next_run=next_3am
@@ -57,3 +70,13 @@ class Command(BaseCommand):
             Schedule.objects.create(
                 func="apostello.tasks.cleanup_expired_sms", schedule_type=Schedule.DAILY, repeats=-1, next_run=next_3am
             )
+
+        if Schedule.objects.filter(func="apostello.tasks.archive_queued_sms").count() < 1:
+            Schedule.objects.create(
+                func="apostello.tasks.archive_queued_sms", schedule_type=Schedule.DAILY, repeats=-1, next_run=next_3am
+            )
+
+        if Schedule.objects.filter(func="apostello.tasks.purge_tombstones").count() < 1:
+            Schedule.objects.create(
+                func="apostello.tasks.purge_tombstones", schedule_type=Schedule.DAILY, repeats=-1, next_run=next_3am
+            )
@@ -0,0 +1,62 @@
+"""
+Latency histograms.
+
+Timings are counted in fixed buckets kept in the cache, one set of buckets
+per day, so every process adds to the same histogram and percentiles can
+be read without keeping the individual timings.
+"""
+from django.core.cache import cache
+from django.utils import timezone
+
+# bucket upper bounds, in milliseconds:
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, "inf")
+KEEP_DAYS = 7
+
+
+def bucket_key(name, day, bound):
+    """Cache key for a bucket of a histogram."""
+    return "metrics__{0}__{1}__{2}".format(name, day.isoformat(), bound)
+
+
+def observe(name, seconds):
+    """Count a timing (in seconds) in today's `name` histogram."""
+    ms = seconds * 1000
+    bound = next(b for b in BUCKETS if b == "inf" or ms <= b)
+    key = bucket_key(name, timezone.localdate(), bound)
+    cache.add(key, 0, KEEP_DAYS * 24 * 60 * 60)
+    cache.incr(key)
+
+
+def histogram(name, day=None):
+    """Count in each bucket of the `name` histogram for `day` (defaults to today), as (upper bound, count) pairs."""
+    day = day or timezone.localdate()
+    found = cache.get_many([bucket_key(name, day, b) for b in BUCKETS])
+    return [(b, found.get(bucket_key(name, day, b), 0)) for b in BUCKETS]
+
+
+def percentile(hist, q):
+    """
+    Upper bound of the bucket that holds the `q`th percentile of `hist`.
+
+    Returns None for an empty histogram.
+    """
+    total = sum(count for _, count in hist)
+    if total == 0:
+        return None
+    seen = 0
+    for bound, count in hist:
+        seen += count
+        if seen >= total * q / 100:
+            return bound
+
+
+def summary(name, day=None):
+    """Total count, buckets and percentiles of a histogram."""
+    hist = histogram(name, day)
+    return {
+        "count": sum(count for _, count in hist),
+        "buckets": [{"le": bound, "count": count} for bound, count in hist],
+        "p50": percentile(hist, 50),
+        "p90": percentile(hist, 90),
+        "p99": percentile(hist, 99),
+    }
@@ -0,0 +1,43 @@
+# Generated by Django 2.1.2 on 2026-10-19 01:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("apostello", "0025_auto_20180822_1122")]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailySmsStats",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("day", models.DateField()),
+                ("direction", models.CharField(choices=[("in", "Incoming"), ("out", "Outgoing")], max_length=3)),
+                (
+                    "dimension",
+                    models.CharField(
+                        choices=[
+                            ("total", "Total"),
+                            ("keyword", "Keyword"),
+                            ("group", "Group"),
+                            ("contact", "Contact"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "value",
+                    models.CharField(
+                        blank=True, help_text="Keyword, group name or contact number. Blank for totals.", max_length=200
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+            options={"ordering": ["day"]},
+        ),
+        migrations.AlterUniqueTogether(
+            name="dailysmsstats", unique_together={("day", "direction", "dimension", "value")}
+        ),
+        migrations.AlterIndexTogether(name="dailysmsstats", index_together={("dimension", "direction", "value")}),
+    ]
@@ -0,0 +1,14 @@
+# Generated by Django 2.1.2 on 2026-10-19 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("apostello", "0027_index_message_times")]
+
+    operations = [
+        migrations.AddField(
+            model_name="queuedsms", name="claimed_at", field=models.DateTimeField(blank=True, null=True)
+        )
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.1.2 on 2026-10-19 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("apostello", "0028_queuedsms_claimed_at")]
+
+    operations = [
+        migrations.CreateModel(
+            name="QueuedSmsHistory",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("time_to_send", models.DateTimeField()),
+                ("sent", models.BooleanField(default=False)),
+                ("failed", models.BooleanField(default=False)),
+                ("content", models.CharField(max_length=1600, verbose_name="Message")),
+                ("sent_by", models.CharField(max_length=200, verbose_name="Sender")),
+                ("time_archived", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to="apostello.Recipient"
+                    ),
+                ),
+                (
+                    "recipient_group",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="apostello.RecipientGroup",
+                    ),
+                ),
+            ],
+            options={"verbose_name_plural": "Queued sms history", "ordering": ["time_to_send"]},
+        ),
+        migrations.AlterIndexTogether(name="queuedsms", index_together={("sent", "time_to_send")}),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.2 on 2026-10-19 11:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("apostello", "0029_queuedsmshistory")]
+
+    operations = [
+        migrations.AddField(
+            model_name="smsinbound",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        )
+    ]
@@ -1,7 +1,6 @@
 import hashlib
 import logging
 import re
-from math import ceil
 
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -9,13 +8,15 @@ from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
 from django.core.exceptions import ValidationError
 from django.urls import reverse
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import OuterRef, Subquery
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django_q.models import Schedule
-from django_q.tasks import async_task, schedule
+from django_q.tasks import async_task
 from phonenumber_field.modelfields import PhoneNumberField
 
+from apostello import audience, segments, templating
 from apostello.exceptions import NoKeywordMatchException
 from apostello.utils import fetch_default_reply
 from apostello.validators import (
@@ -29,6 +30,7 @@ from apostello.validators import (
     twilio_reserved,
     validate_lower,
 )
+from apostello.versions import bump_version, get_version
 from site_config.models import ConfigurationError, SiteConfiguration
 
 logger = logging.getLogger("apostello")
@@ -36,6 +38,38 @@ logger = logging.getLogger("apostello")
 # precompile regex to remove non-alphanumeric characters:
 re_non_alpha_numeric = re.compile("[\W_]+")
 
+# keywords (and the version stamp they were fetched at), kept in process memory by `Keyword.index`:
+_keyword_index = {"version": None, "keywords": []}
+
+# number of senders to look up per query when filling the last sms cache:
+LAST_SMS_BATCH_SIZE = 500
+
+
+def _summarise_last_sms(sms):
+    """Summary of a message, as shown in the contacts table."""
+    if sms is None:
+        return {"content": "", "time_received": ""}
+    t = sms.time_received
+    if t is not None:
+        t = t.strftime("%d %b %H:%M")
+    return {"content": sms.content, "time_received": t}
+
+
+def count_sms(msg, recipients, group=None):
+    """
+    Number of sms needed to send `msg` to each of `recipients`.
+
+    Placeholders are filled in for each recipient first, as names can change
+    the length, or even the encoding, of the message.
+    """
+    template = templating.compile_template(msg)
+    if not template.names:
+        num_recipients = recipients.count() if isinstance(recipients, models.QuerySet) else len(recipients)
+        return num_recipients * segments.segment_count(msg)
+    if isinstance(recipients, models.QuerySet):
+        recipients = recipients.only("first_name", "last_name")
+    return sum(template.segment_count(name=r.first_name, last_name=r.last_name, group=group or "") for r in recipients)
+
 
 class RecipientGroup(models.Model):
     """Stores groups of recipients."""
@@ -43,6 +77,7 @@ class RecipientGroup(models.Model):
     is_archived = models.BooleanField("Archived", default=False)
     name = models.CharField("Name of group", max_length=150, unique=True, validators=[gsm_validator])
     description = models.CharField("Group description", max_length=200)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def send_message(self, content, sent_by, eta=None):
         """Send message to group."""
@@ -56,10 +91,9 @@ class RecipientGroup(models.Model):
 
     def check_user_cost_limit(self, limit, msg):
         """Check the user has not exceeded their per SMS cost limit."""
-        num_sms = ceil(len(msg) / 160)
         if limit == 0:
             return
-        if limit < num_sms * self.calculate_cost():
+        if limit < self.calculate_cost(msg):
             raise ValidationError("Sorry, you can only send messages that cost no more than ${0}.".format(limit))
 
     @cached_property
@@ -77,13 +111,21 @@ class RecipientGroup(models.Model):
         """List of the names of recipients."""
         return [str(x) for x in self.all_recipients]
 
-    def calculate_cost(self):
-        """Calculate the cost of sending to this group."""
+    def calculate_cost(self, msg=None):
+        """
+        Calculate the cost of sending to this group.
+
+        If `msg` is given, the number of sms needed to send it to each member
+        that will receive it is taken into account, otherwise a single sms per
+        member is assumed.
+        """
         try:
             cost = SiteConfiguration.get_twilio_settings()["sending_cost"]
         except ConfigurationError:
             cost = 0
-        return cost * self.all_recipients.count()
+        if msg is None:
+            return cost * self.all_recipients.count()
+        return cost * count_sms(msg, audience.sendable(self.all_recipients), group=self.name)
 
     def __str__(self):
         """Pretty representation."""
@@ -117,15 +159,20 @@ class Recipient(models.Model):
     )
     notes = models.TextField("Notes", max_length=2000, blank=True, null=True)
     groups = models.ManyToManyField(RecipientGroup, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
-    def personalise(self, message):
+    def personalise(self, message, group=None):
         """
         Personalise outgoing message.
 
-        Any occurence of "%name%" will be replaced with the Recipient's first
-        name.
+        Any occurence of "%name%" or "%last_name%" will be replaced with the
+        Recipient's first or last name. If a `group` name is given, "%group%"
+        is replaced too.
         """
-        return message.replace("%name%", self.first_name)
+        context = {"name": self.first_name, "last_name": self.last_name}
+        if group is not None:
+            context["group"] = group
+        return templating.render(message, **context)
 
     def send_message(self, content="", group=None, sent_by="", eta=None):
         """
@@ -159,34 +206,79 @@ class Recipient(models.Model):
     @staticmethod
     def check_user_cost_limit(recipients, limit, msg):
         """Check the user has not exceeded their per SMS cost limit."""
-        cost = SiteConfiguration.get_twilio_settings()["sending_cost"]
-        num_sms = ceil(len(msg) / 160)
         if limit == 0:
             return
-        if limit < len(recipients) * cost * num_sms:
+        cost = SiteConfiguration.get_twilio_settings()["sending_cost"]
+        if isinstance(recipients, models.QuerySet):
+            recipients = audience.sendable(recipients)
+        if limit < cost * count_sms(msg, recipients):
             raise ValidationError("Sorry, you can only send messages that cost no more than ${0}.".format(limit))
 
     @cached_property
     def full_name(self):
         """Recipient's full name."""
-        return "{fn} {ln}".format(fn=self.first_name, ln=self.last_name)
+        return Recipient.format_full_name(self.first_name, self.last_name)
+
+    @staticmethod
+    def format_full_name(first_name, last_name):
+        """Full name from a first and last name."""
+        return "{fn} {ln}".format(fn=first_name, ln=last_name)
 
     @property
     def last_sms(self):
         """Last message sent to this person"""
-        last_sms = cache.get("last_msg__{0}".format(self.pk))
-        if last_sms is None:
-            msg = SmsInbound.objects.filter(sender_num=str(self.number))
-            try:
-                msg = msg[0]  # sms are already sorted in time
-                t = msg.time_received
-                if t is not None:
-                    t = t.strftime("%d %b %H:%M")
-                last_sms = {"content": msg.content, "time_received": t}
-            except IndexError:
-                last_sms = {"content": "", "time_received": ""}
-            cache.set("last_msg__{0}".format(self.pk), last_sms, 600)
-        return last_sms
+        try:
+            return self._last_sms
+        except AttributeError:
+            return Recipient.fetch_last_sms([self])[self.pk]
+
+    @staticmethod
+    def last_sms_cache_key(number):
+        """Cache key for the last message received from `number`."""
+        return "last_msg__{0}".format(number)
+
+    @staticmethod
+    def cache_last_sms(sms):
+        """Write an incoming message through to its sender's last sms cache."""
+        cache.set(Recipient.last_sms_cache_key(sms.sender_num), _summarise_last_sms(sms), 600)
+
+    @staticmethod
+    def cache_last_sms_many(messages):
+        """Write a batch of incoming messages through to their senders' last sms cache."""
+        cache.set_many(
+            {Recipient.last_sms_cache_key(sms.sender_num): _summarise_last_sms(sms) for sms in messages}, 600
+        )
+
+    @staticmethod
+    def fetch_last_sms(recipients):
+        """
+        Look up the last message for a batch of recipients.
+
+        The cache is read once for the whole batch and any misses are filled
+        with a single query. Returns a dict keyed by recipient pk.
+        """
+        last_sms = Recipient.fetch_last_sms_by_number([r.number for r in recipients])
+        return {r.pk: last_sms[str(r.number)] for r in recipients}
+
+    @staticmethod
+    def fetch_last_sms_by_number(numbers):
+        """Look up the last message from each of `numbers`, like `fetch_last_sms`. Returns a dict keyed by number."""
+        by_key = {Recipient.last_sms_cache_key(n): str(n) for n in numbers}
+        found = {k: v for k, v in cache.get_many(list(by_key)).items() if v is not None}
+        missing = [k for k in by_key if k not in found]
+        if missing:
+            latest = SmsInbound.latest_by_sender([by_key[k] for k in missing])
+            fetched = {k: _summarise_last_sms(latest.get(by_key[k])) for k in missing}
+            cache.set_many(fetched, 600)
+            found.update(fetched)
+        return {n: found[k] for k, n in by_key.items()}
+
+    @staticmethod
+    def prefetch_last_sms(recipients):
+        """Populate `last_sms` on each recipient in the batch."""
+        last_sms = Recipient.fetch_last_sms(recipients)
+        for recipient in recipients:
+            recipient._last_sms = last_sms[recipient.pk]
 
     def save(self, *args, **kwargs):
         """Override save method to back date name change to SMS."""
@@ -290,6 +382,7 @@ class Keyword(models.Model):
         help_text="Choose users that will receive daily updates of matched " "messages.",
     )
     last_email_sent_time = models.DateTimeField("Time of last sent email", blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def construct_reply(self, recipient):
         """Make reply to an incoming message."""
@@ -300,14 +393,52 @@ class Keyword(models.Model):
         """Add contact to linked group.
 
         If this keyword has a linked group, we want to add the contact that
-        sent the current SMS.
+        sent the current SMS. `sender` can be a Recipient or its pk. Only
+        missing memberships are inserted, in one go.
 
         Note, this will only be called if we have already matched the keyword.
         """
-        for grp in self.linked_groups.all():
-            if not grp.is_archived:
-                grp.recipient_set.add(sender)
-                grp.save()
+        group_pks = self.linked_group_pks()
+        if not group_pks:
+            return
+        sender_pk = getattr(sender, "pk", sender)
+        membership = Recipient.groups.through
+        existing = set(
+            membership.objects.filter(recipient_id=sender_pk, recipientgroup_id__in=group_pks).values_list(
+                "recipientgroup_id", flat=True
+            )
+        )
+        missing = [pk for pk in group_pks if pk not in existing]
+        if not missing:
+            return
+        try:
+            with transaction.atomic():
+                membership.objects.bulk_create(
+                    [membership(recipient_id=sender_pk, recipientgroup_id=pk) for pk in missing]
+                )
+        except IntegrityError:
+            # added to a group by another message in the meantime:
+            Recipient.objects.get(pk=sender_pk).groups.add(*missing)
+        else:
+            from apostello import sync
+
+            # bulk_create does not send m2m_changed:
+            bump_version(RecipientGroup)
+            sync.touch(RecipientGroup, missing)
+
+    def linked_group_pks(self):
+        """
+        Pks of the (unarchived) groups linked to this keyword.
+
+        Cached until a keyword changes, which includes changes to linked
+        groups (see `apostello.signals`).
+        """
+        key = "keyword_linked_groups__{0}__{1}".format(self.pk, get_version(Keyword))
+        group_pks = cache.get(key)
+        if group_pks is None:
+            group_pks = list(self.linked_groups.filter(is_archived=False).values_list("pk", flat=True))
+            cache.set(key, group_pks, 24 * 60 * 60)
+        return group_pks
 
     def get_current_response(self, recipient=None):
         if self.disable_all_replies:
@@ -328,7 +459,7 @@ class Keyword(models.Model):
                 if recipient.first_name == "Unknown":
                     reply = self.custom_response_new_person or reply
 
-        return reply.replace("%keyword%", self.keyword)
+        return templating.render(reply, keyword=self.keyword)
 
     @cached_property
     def current_response(self, recipient=None):
@@ -437,6 +568,19 @@ class Keyword(models.Model):
         super(Keyword, self).save(force_insert, force_update, *args, **kwargs)
         async_task("apostello.tasks.populate_keyword_response_count", pk=self.pk)
 
+    @staticmethod
+    def index():
+        """
+        All keywords, in the order they are matched.
+
+        The keywords are kept in memory and only fetched again after a
+        keyword has changed, so matching a message does not hit the database.
+        """
+        version = get_version(Keyword)
+        if _keyword_index["version"] != version:
+            _keyword_index.update(version=version, keywords=list(Keyword.objects.all()))
+        return _keyword_index["keywords"]
+
     @staticmethod
     def _match(sms):
         """Match keyword or raises exception."""
@@ -453,7 +597,7 @@ class Keyword(models.Model):
         elif cleaned_sms.startswith("name"):
             return "name"
 
-        for keyword in Keyword.objects.all():
+        for keyword in Keyword.index():
             if cleaned_sms.startswith(str(keyword)):
                 query_keyword = keyword
                 # return <Keyword object>
@@ -472,8 +616,11 @@ class Keyword(models.Model):
     @staticmethod
     def lookup_colour(sms):
         """Generate. colour for sms table."""
-        keyword = Keyword.match(sms)
+        return Keyword.keyword_colour(Keyword.match(sms))
 
+    @staticmethod
+    def keyword_colour(keyword):
+        """Colour for messages that matched `keyword` (a Keyword or the name of a built in keyword)."""
         if keyword == "stop":
             return "#FFCDD2"
         elif keyword == "name":
@@ -500,7 +647,7 @@ class SmsInbound(models.Model):
         "Dealt With?", default=False, help_text="Used, for example, " "to mark people as registered for an event."
     )
     content = models.CharField("Message body", blank=True, max_length=1600)
-    time_received = models.DateTimeField(blank=True, null=True)
+    time_received = models.DateTimeField(blank=True, null=True, db_index=True)
     sender_name = models.CharField("Sent by", max_length=200)
     sender_num = models.CharField("Sent from", max_length=200)
     matched_keyword = models.CharField(max_length=12, db_index=True)
@@ -508,6 +655,7 @@ class SmsInbound(models.Model):
     display_on_wall = models.BooleanField(
         "Display on Wall?", default=False, help_text="If True, SMS will be shown on all live walls."
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def archive(self):
         """Archive the SMS."""
@@ -531,7 +679,17 @@ class SmsInbound(models.Model):
     @cached_property
     def sender_pk(self):
         """pk for message sender."""
-        return Recipient.objects.get(number=self.sender_num).pk
+        try:
+            # looked up with the message, see `annotate_sender_pk`:
+            return self._sender_pk
+        except AttributeError:
+            return Recipient.objects.get(number=self.sender_num).pk
+
+    @staticmethod
+    def annotate_sender_pk(messages):
+        """Look up the sender of each message in the same query, rather than a query per message."""
+        senders = Recipient.objects.filter(number=OuterRef("sender_num")).values("pk")[:1]
+        return messages.annotate(_sender_pk=Subquery(senders))
 
     def reimport(self):
         """
@@ -547,11 +705,26 @@ class SmsInbound(models.Model):
         self.save()
         return self
 
+    @staticmethod
+    def latest_by_sender(numbers):
+        """Map each number to the most recent message it sent."""
+        latest = {}
+        for i in range(0, len(numbers), LAST_SMS_BATCH_SIZE):
+            msgs = SmsInbound.objects.filter(sender_num__in=numbers[i : i + LAST_SMS_BATCH_SIZE])
+            if connection.features.can_distinct_on_fields:
+                msgs = msgs.order_by("sender_num", "-time_received").distinct("sender_num")
+            else:
+                newest = SmsInbound.objects.filter(sender_num=OuterRef("sender_num")).order_by("-time_received")
+                msgs = msgs.filter(pk=Subquery(newest.values("pk")[:1]))
+            for msg in msgs.only("sender_num", "content", "time_received"):
+                latest[msg.sender_num] = msg
+        return latest
+
     def save(self, *args, **kwargs):
         """Override save method to invalidate cache."""
         super(SmsInbound, self).save(*args, **kwargs)
         # invalidate per person last sms cache
-        cache.set("last_msg__{0}".format(self.sender_num), None, 0)
+        cache.delete(Recipient.last_sms_cache_key(self.sender_num))
         # update number of matched responses caches
         async_task("apostello.tasks.populate_keyword_response_count")
 
@@ -578,6 +751,29 @@ class QueuedSms(models.Model):
         on_delete=models.CASCADE,
     )
     recipient = models.ForeignKey(Recipient, blank=True, null=True, on_delete=models.CASCADE)
+    # set when a worker picks the message up to send, see `apostello.tasks.send_queued_sms`:
+    claimed_at = models.DateTimeField(blank=True, null=True)
+
+    @staticmethod
+    def schedule(recipients, content, sent_by, time_to_send, recipient_group=None):
+        """
+        Queue a message for each of `recipients` (a queryset).
+
+        The messages are inserted in bulk, rather than one query per
+        recipient. Returns the number of messages queued.
+        """
+        queued = [
+            QueuedSms(
+                time_to_send=time_to_send,
+                content=content,
+                sent_by=sent_by,
+                recipient_group=recipient_group,
+                recipient_id=pk,
+            )
+            for pk in recipients.order_by().values_list("pk", flat=True)
+        ]
+        QueuedSms.objects.bulk_create(queued, batch_size=500)
+        return len(queued)
 
     def cancel(self):
         """Cancel message."""
@@ -588,7 +784,10 @@ class QueuedSms(models.Model):
         if self.sent or self.failed:
             # only try to send once
             return
+        self.deliver()
 
+    def deliver(self):
+        """Send the sms, and mark it as sent or failed."""
         from apostello.tasks import recipient_send_message_task
 
         try:
@@ -596,12 +795,14 @@ class QueuedSms(models.Model):
                 group = self.recipient_group.name
             else:
                 group = None
-            recipient_send_message_task(self.recipient.pk, self.content, group, self.sent_by)
+            recipient_send_message_task(self.recipient_id, self.content, group, self.sent_by)
             self.sent = True
         except Exception as e:
+            logger.error("Failed to send queued sms %s", self.pk, exc_info=True)
+            self.sent = False
             self.failed = True
 
-        self.save()
+        self.save(update_fields=["sent", "failed"])
 
     def __str__(self):
         """Pretty representation."""
@@ -613,6 +814,25 @@ class QueuedSms(models.Model):
 
     class Meta:
         ordering = ["time_to_send"]
+        # the scheduler and the queued messages page only look at unsent messages:
+        index_together = [["sent", "time_to_send"]]
+
+
+class QueuedSmsHistory(models.Model):
+    """A sent or failed QueuedSms, moved out of the queue by `apostello.tasks.archive_queued_sms`."""
+
+    time_to_send = models.DateTimeField()
+    sent = models.BooleanField(default=False)
+    failed = models.BooleanField(default=False)
+    content = models.CharField("Message", max_length=1600)
+    sent_by = models.CharField("Sender", max_length=200)
+    recipient_group = models.ForeignKey(RecipientGroup, null=True, blank=True, on_delete=models.CASCADE)
+    recipient = models.ForeignKey(Recipient, blank=True, null=True, on_delete=models.CASCADE)
+    time_archived = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["time_to_send"]
+        verbose_name_plural = "Queued sms history"
 
 
 class SmsOutbound(models.Model):
@@ -620,7 +840,7 @@ class SmsOutbound(models.Model):
 
     sid = models.CharField("SID", max_length=34, unique=True, help_text="Twilio's unique ID for this SMS")
     content = models.CharField("Message", max_length=1600, validators=[gsm_validator])
-    time_sent = models.DateTimeField(default=timezone.now)
+    time_sent = models.DateTimeField(default=timezone.now, db_index=True)
     sent_by = models.CharField(
         "Sender", max_length=200, help_text="User that sent message. Stored for auditing purposes."
     )
@@ -633,6 +853,7 @@ class SmsOutbound(models.Model):
     )
     recipient = models.ForeignKey(Recipient, blank=True, null=True, on_delete=models.CASCADE)
     status = models.CharField("Status", max_length=50, help_text="Status of SMS (from Twilio)")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def delete_from_twilio(self):
         """
@@ -651,6 +872,75 @@ class SmsOutbound(models.Model):
         ordering = ["-time_sent"]
 
 
+class Tombstone(models.Model):
+    """
+    Records that a row has been deleted.
+
+    The API returns these to clients syncing a collection with a `since`
+    cursor, so they can drop objects that no longer exist.
+    """
+
+    model = models.CharField(max_length=50)
+    object_pk = models.IntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def record(cls, model_class, pks):
+        """Record the deletion of the rows of `model_class` with primary keys `pks`."""
+        label = model_class._meta.label_lower
+        now = timezone.now()
+        cls.objects.bulk_create([cls(model=label, object_pk=pk, deleted_at=now) for pk in pks], batch_size=1000)
+
+    @classmethod
+    def deleted_since(cls, model_class, since):
+        """Primary keys of the rows of `model_class` deleted after `since`."""
+        return list(
+            cls.objects.filter(model=model_class._meta.label_lower, deleted_at__gt=since)
+            .values_list("object_pk", flat=True)
+            .distinct()
+        )
+
+    class Meta:
+        index_together = [["model", "deleted_at"]]
+
+
+class DailySmsStats(models.Model):
+    """
+    Number of messages sent or received on a single (local) day.
+
+    Rows are rolled up from the message logs by `apostello.stats`. Each day
+    has a total row for each direction, along with a row for each keyword,
+    group and contact that had any messages.
+    """
+
+    IN = "in"
+    OUT = "out"
+    DIRECTION_CHOICES = ((IN, "Incoming"), (OUT, "Outgoing"))
+
+    TOTAL = "total"
+    KEYWORD = "keyword"
+    GROUP = "group"
+    CONTACT = "contact"
+    DIMENSION_CHOICES = ((TOTAL, "Total"), (KEYWORD, "Keyword"), (GROUP, "Group"), (CONTACT, "Contact"))
+
+    day = models.DateField()
+    direction = models.CharField(max_length=3, choices=DIRECTION_CHOICES)
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    value = models.CharField(
+        max_length=200, blank=True, help_text="Keyword, group name or contact number. Blank for totals."
+    )
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        """Pretty representation."""
+        return "{0} {1} {2} {3}: {4}".format(self.day, self.direction, self.dimension, self.value, self.count)
+
+    class Meta:
+        ordering = ["day"]
+        unique_together = ["day", "direction", "dimension", "value"]
+        index_together = ["dimension", "direction", "value"]
+
+
 class UserProfile(models.Model):
     """
     Stores permissions related to a User.
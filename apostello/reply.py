@@ -1,16 +1,57 @@
 import logging
-from datetime import timedelta
 
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from django_q.models import Schedule
-from django_q.tasks import async_task, schedule
+from django_q.tasks import async_task
 
 from apostello.models import Keyword, Recipient
 from apostello.utils import fetch_default_reply
 
 logger = logging.getLogger("apostello")
 
+# how long to remember incoming messages, so webhooks retried by Twilio are not handled twice:
+SEEN_SMS_TIMEOUT = 24 * 60 * 60
+# how long a message being handled stays claimed, about as long as Twilio
+# waits for the webhook. If the worker dies before replying, Twilio's retry
+# finds the claim gone and the message is handled again:
+PENDING_SMS_TIMEOUT = 15
+# stored for a message that is still being handled:
+PENDING_REPLY = "__pending__"
+
+
+def seen_sms_key(sid):
+    """Cache key for an incoming message we have already seen."""
+    return "inbound_sms__{0}".format(sid)
+
+
+def claim_sms(sid):
+    """
+    Record that we are handling the incoming message `sid`.
+
+    Returns False if the message has already been seen, in which case it
+    must not be handled again (use `previous_reply` instead).
+    """
+    return cache.add(seen_sms_key(sid), PENDING_REPLY, PENDING_SMS_TIMEOUT)
+
+
+def release_sms(sid):
+    """Forget message `sid`, so it can be handled again if handling it failed."""
+    cache.delete(seen_sms_key(sid))
+
+
+def remember_reply(sid, reply):
+    """Store the reply sent to message `sid`."""
+    cache.set(seen_sms_key(sid), reply, SEEN_SMS_TIMEOUT)
+
+
+def previous_reply(sid):
+    """Reply sent to message `sid`, or "" if it is still being handled."""
+    reply = cache.get(seen_sms_key(sid))
+    if reply is None or reply == PENDING_REPLY:
+        return ""
+    return reply
+
 
 class InboundSms:
     """Handle incoming messages."""
@@ -29,26 +70,45 @@ class InboundSms:
             contact.save()
             return contact, not self.keyword == "name"
 
+    def find_contact(self):
+        """
+        Find the sender without creating them.
+
+        An unknown sender gets an unsaved Recipient, and is created in the
+        background by `apostello.tasks.process_inbound`.
+        """
+        try:
+            return Recipient.objects.get(number=self.contact_number), False
+        except Recipient.DoesNotExist:
+            return Recipient(number=self.contact_number, first_name="Unknown", last_name="Person"), True
+
     def start_bg_tasks(self):
         """
-        Kick off background tasks for each message.
+        Kick off background processing of the message.
 
-        Starts tasks to:
+        A single task (`apostello.tasks.process_inbound`) is queued to:
             * Log the message in the db
             * Post the message to slack
             * Send blacklist warnings if required
             * Ask the contact for their name if we don't have it
-            * Schedules a task to check the outgoing log one minute from now
+            * Schedule a check of the outgoing log one minute from now
+            * Create the contact and add them to the keyword's linked groups,
+              if that was left for later (see `__init__`)
         """
-        async_task("apostello.tasks.log_msg_in", self.msg_params, timezone.now(), self.contact.pk)
-        async_task("apostello.tasks.sms_to_slack", self.sms_body, str(self.contact), str(self.keyword))
-        async_task("apostello.tasks.blacklist_notify", self.contact.pk, self.sms_body, self.keyword)
-        async_task("apostello.tasks.ask_for_name", self.contact.pk, self.sms_body, self.send_name_sms)
-        # update outgoing log 1 minute from now:
-        schedule(
-            "apostello.tasks.check_outgoing_log",
-            schedule_type=Schedule.ONCE,
-            next_run=timezone.now() + timedelta(minutes=1),
+        contact = {
+            "pk": self.contact.pk,
+            "name": str(self.contact),
+            "number": str(self.contact.number),
+            "is_blocking": self.contact.is_blocking,
+        }
+        async_task(
+            "apostello.tasks.process_inbound",
+            self.msg_params,
+            timezone.now(),
+            contact,
+            str(self.keyword),
+            self.send_name_sms,
+            linked_keyword=self.keyword.pk if self.fast_path and isinstance(self.keyword, Keyword) else None,
         )
 
     def reply_to_start(self):
@@ -84,8 +144,8 @@ class InboundSms:
                 "[Apostello] New Signup!",
                 "SMS:\n\t{0}\nFrom:\n\t{1} ({2})\n".format(self.sms_body, str(self.contact), self.contact_number),
             )
-            # TODO update to use .format() and add help text to model
-            return fetch_default_reply("name_update_reply") % self.contact.first_name
+            # "%s" is the original placeholder for the name in this reply:
+            return self.contact.personalise(fetch_default_reply("name_update_reply").replace("%s", "%name%"))
         except (ValidationError, IndexError):
             async_task(
                 "apostello.tasks.notify_office_mail",
@@ -119,16 +179,31 @@ class InboundSms:
         else:
             return reply
 
-    def __init__(self, msg_params):
+    def __init__(self, msg_params, fast_path=False):
+        """
+        Match the message and work out the reply.
+
+        With `fast_path`, only the work needed for the reply is done here:
+        new contacts are not created and the contact is not added to the
+        keyword's linked groups until the message is processed in the
+        background. Messages that change the contact (start, stop and name)
+        are always handled in full.
+        """
         self.msg_params = msg_params
         self.contact_number = msg_params["From"]
         self.sms_body = msg_params["Body"].strip()
         # match keyword:
         self.keyword = Keyword.match(self.sms_body)
+        self.fast_path = fast_path and self.keyword not in ("start", "stop", "name")
         # look up contact and determine if we need to ask for their name:
-        self.contact, self.send_name_sms = self.lookup_contact()
+        if self.fast_path:
+            self.contact, self.send_name_sms = self.find_contact()
+        else:
+            self.contact, self.send_name_sms = self.lookup_contact()
         # construct reply sms
         self.reply = self.construct_reply()
+        if self.fast_path:
+            return
         # add contact to keyword linked groups:
         try:
             self.keyword.add_contact_to_groups(self.contact)
@@ -0,0 +1,60 @@
+"""
+Count the sms needed to send a message.
+
+A message that only uses the GSM 03.38 character set is sent with the
+7 bit GSM encoding: 160 characters fit in a single sms, or 153 in each
+part of a longer message. Characters from the GSM extension table (e.g.
+"€" or "{") take up two characters. Any other character forces the whole
+message into UCS-2, where an sms only holds 70 characters (67 per part).
+
+This module has no dependencies, so it can be used outside of Django
+(see scripts/benchmark_segments.py).
+"""
+from collections import namedtuple
+
+GSM = "gsm"
+UCS2 = "ucs2"
+
+GSM_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# characters that are sent with an escape code, so count twice:
+GSM_EXTENDED = frozenset("\f^{}\\[~]|€")
+GSM_CHARS = GSM_BASIC | GSM_EXTENDED
+
+# characters per (single sms, part of a concatenated sms) for each encoding:
+SEGMENT_SIZES = {GSM: (160, 153), UCS2: (70, 67)}
+
+SmsLength = namedtuple("SmsLength", ["encoding", "characters", "segments"])
+
+
+def measure(text):
+    """
+    Work out the encoding, encoded length and number of sms for `text`.
+
+    Returns an SmsLength.
+    """
+    chars = set(text)
+    if chars <= GSM_BASIC:
+        encoding, length = GSM, len(text)
+    elif chars <= GSM_CHARS:
+        encoding, length = GSM, len(text) + sum(text.count(c) for c in chars & GSM_EXTENDED)
+    else:
+        encoding, length = UCS2, len(text)
+        if any(ord(c) > 0xFFFF for c in chars):
+            # characters outside the basic multilingual plane need a surrogate pair:
+            length += sum(1 for c in text if ord(c) > 0xFFFF)
+
+    return SmsLength(encoding, length, segments_for_length(length, encoding))
+
+
+def segments_for_length(length, encoding=GSM):
+    """Number of sms needed to send `length` characters with `encoding`."""
+    single, part = SEGMENT_SIZES[encoding]
+    return 1 if length <= single else -(-length // part)
+
+
+def segment_count(text):
+    """Number of sms needed to send `text`."""
+    return measure(text).segments
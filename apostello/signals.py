@@ -1,10 +1,15 @@
 from allauth.account.signals import user_signed_up
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 
 from apostello.tasks import send_async_mail
-from apostello.models import UserProfile
+from apostello import sync
+from apostello.models import Keyword, Recipient, RecipientGroup, SmsInbound, SmsOutbound, Tombstone, UserProfile
+from apostello.versions import bump_version
+
+# models whose version stamp is bumped on every change, see `apostello.versions`
+VERSIONED_MODELS = (Keyword, Recipient, RecipientGroup, SmsInbound, SmsOutbound)
 
 
 @receiver(user_signed_up)
@@ -29,3 +34,55 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
     instance.profile.save()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def bump_model_version(sender, **kwargs):
+    """Bump the version stamp of tracked models when they change."""
+    if sender in VERSIONED_MODELS:
+        bump_version(sender)
+
+
+@receiver(m2m_changed, sender=Recipient.groups.through)
+def bump_group_membership_version(sender, instance, action, pk_set, **kwargs):
+    """Group membership is part of the group, so bump its version stamp."""
+    sync.touch_m2m(RecipientGroup, instance, action, pk_set, sender)
+    if action.startswith("post_"):
+        bump_version(RecipientGroup)
+
+
+@receiver(m2m_changed, sender=Keyword.linked_groups.through)
+def bump_linked_groups_version(sender, instance, action, pk_set, **kwargs):
+    """Linked groups are part of the keyword, so bump its version stamp."""
+    sync.touch_m2m(Keyword, instance, action, pk_set, sender)
+    if action.startswith("post_"):
+        bump_version(Keyword)
+
+
+@receiver(m2m_changed, sender=Keyword.owners.through)
+@receiver(m2m_changed, sender=Keyword.subscribed_to_digest.through)
+def bump_keyword_users_version(sender, instance, action, pk_set, **kwargs):
+    """Owners and digest subscribers are part of the keyword, and decide who can see its messages."""
+    sync.touch_m2m(Keyword, instance, action, pk_set, sender)
+    if action.startswith("post_"):
+        bump_version(Keyword)
+
+
+@receiver(post_delete)
+def record_tombstone(sender, instance, **kwargs):
+    """Record deletions, so clients syncing with the API can drop the object."""
+    if sender in sync.SYNCED_MODELS:
+        Tombstone.record(sender, [instance.pk])
+
+
+@receiver(pre_delete, sender=RecipientGroup)
+def touch_keywords_on_group_delete(sender, instance, **kwargs):
+    """Deleting a group unlinks it from keywords."""
+    sync.touch(Keyword, instance.keyword_set.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=RecipientGroup)
+def bump_keyword_version_on_group_delete(sender, **kwargs):
+    """Deleting a group unlinks it from keywords without sending m2m_changed."""
+    bump_version(Keyword)
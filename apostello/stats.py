@@ -0,0 +1,181 @@
+"""
+Daily message statistics.
+
+Message counts for each closed day are rolled up into `DailySmsStats` by a
+scheduled task. Reports read the rolled up rows and only count the raw
+messages logged since the last roll up, so their cost does not grow with
+the size of the message logs.
+"""
+import logging
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apostello.models import DailySmsStats, SmsInbound, SmsOutbound
+
+logger = logging.getLogger("apostello")
+
+# message log, time field and the field behind each dimension for each direction:
+SOURCES = {
+    DailySmsStats.IN: (
+        SmsInbound,
+        "time_received",
+        {DailySmsStats.KEYWORD: "matched_keyword", DailySmsStats.CONTACT: "sender_num"},
+    ),
+    DailySmsStats.OUT: (
+        SmsOutbound,
+        "time_sent",
+        {DailySmsStats.GROUP: "recipient_group__name", DailySmsStats.CONTACT: "recipient__number"},
+    ),
+}
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_current_timezone())
+
+
+def _messages(direction, start=None, end=None):
+    """Messages logged on or after local day `start` and before local day `end`."""
+    model_class, time_field, _ = SOURCES[direction]
+    msgs = model_class.objects.order_by()
+    if start is not None:
+        msgs = msgs.filter(**{"{0}__gte".format(time_field): _start_of_day(start)})
+    if end is not None:
+        msgs = msgs.filter(**{"{0}__lt".format(time_field): _start_of_day(end)})
+    return msgs
+
+
+def _count_per_day(direction, start=None, end=None, field=None):
+    """
+    Count messages per local day (and per `field`) with a single aggregate query.
+
+    Returns a list of (day, count) or (day, value, count) tuples.
+    """
+    _, time_field, _ = SOURCES[direction]
+    group_by = ["day"] if field is None else ["day", field]
+    return list(
+        _messages(direction, start, end)
+        .exclude(**{"{0}__isnull".format(time_field): True})
+        .annotate(day=TruncDate(time_field))
+        .values(*group_by)
+        .annotate(n=Count("pk"))
+        .values_list(*group_by + ["n"])
+    )
+
+
+def last_rolled_up_day():
+    """Most recent day in the daily statistics, or None if nothing has been rolled up."""
+    return DailySmsStats.objects.filter(dimension=DailySmsStats.TOTAL).aggregate(day=Max("day"))["day"]
+
+
+def _first_day():
+    """Local day of the oldest message in the logs."""
+    firsts = [
+        model_class.objects.aggregate(first=Min(time_field))["first"] for model_class, time_field, _ in SOURCES.values()
+    ]
+    firsts = [timezone.localdate(f) for f in firsts if f is not None]
+    return min(firsts) if firsts else None
+
+
+def update_daily_stats(start=None):
+    """
+    Roll up message counts for every closed day, i.e. every day before today.
+
+    Carries on from the last rolled up day, which is counted again in case
+    messages for it were logged late. Pass a date as `start` to rebuild the
+    statistics from that day onwards.
+
+    Returns the number of rows written.
+    """
+    with timezone.override(settings.TIME_ZONE):
+        today = timezone.localdate()
+        if start is None:
+            start = last_rolled_up_day() or _first_day()
+        if start is None or start >= today:
+            return 0
+
+        days = [start + timedelta(days=x) for x in range((today - start).days)]
+        rows = []
+        for direction, (_, _, dimensions) in SOURCES.items():
+            # totals are dense, so every rolled up day has a row, even if nothing was sent:
+            totals = dict(_count_per_day(direction, start, today))
+            rows.extend(
+                DailySmsStats(
+                    day=day, direction=direction, dimension=DailySmsStats.TOTAL, value="", count=totals.get(day, 0)
+                )
+                for day in days
+            )
+            for dimension, field in dimensions.items():
+                rows.extend(
+                    DailySmsStats(day=day, direction=direction, dimension=dimension, value=value, count=n)
+                    for day, value, n in _count_per_day(direction, start, today, field)
+                    if value is not None
+                )
+
+        with transaction.atomic():
+            DailySmsStats.objects.filter(day__gte=start, day__lt=today).delete()
+            DailySmsStats.objects.bulk_create(rows, batch_size=500)
+
+    logger.info("Rolled up daily sms statistics from %s to %s (%s rows)", start, days[-1], len(rows))
+    return len(rows)
+
+
+def daily_counts(direction, dates):
+    """
+    Number of messages sent or received on each of `dates`.
+
+    `dates` must be consecutive local days, oldest first. Rolled up days are
+    read from the daily statistics, the rest are counted from the logs.
+    """
+    with timezone.override(settings.TIME_ZONE):
+        counts = {}
+        live_from = dates[0]
+        last = last_rolled_up_day()
+        if last is not None and last >= dates[0]:
+            counts.update(
+                DailySmsStats.objects.filter(
+                    direction=direction, dimension=DailySmsStats.TOTAL, day__gte=dates[0], day__lte=dates[-1]
+                ).values_list("day", "count")
+            )
+            live_from = last + timedelta(days=1)
+        if live_from <= dates[-1]:
+            counts.update(_count_per_day(direction, live_from, dates[-1] + timedelta(days=1)))
+    return [counts.get(d, 0) for d in dates]
+
+
+def totals(direction, dimension, values=None):
+    """
+    All time number of messages for each value of `dimension`.
+
+    `values` (a list or a queryset of values) limits the values counted.
+    Returns a Counter of value to number of messages.
+    """
+    field = SOURCES[direction][2][dimension]
+    with timezone.override(settings.TIME_ZONE):
+        last = last_rolled_up_day()
+        rolled_up = DailySmsStats.objects.filter(direction=direction, dimension=dimension)
+        live = _messages(direction, start=None if last is None else last + timedelta(days=1))
+        if values is not None:
+            rolled_up = rolled_up.filter(value__in=values)
+            live = live.filter(**{"{0}__in".format(field): values})
+
+        counts = Counter(dict(rolled_up.order_by().values("value").annotate(n=Sum("count")).values_list("value", "n")))
+        counts.update(dict(live.values(field).annotate(n=Count("pk")).values_list(field, "n")))
+    counts.pop(None, None)
+    return counts
+
+
+def total(direction):
+    """All time number of messages sent or received."""
+    with timezone.override(settings.TIME_ZONE):
+        last = last_rolled_up_day()
+        n = DailySmsStats.objects.filter(direction=direction, dimension=DailySmsStats.TOTAL).aggregate(n=Sum("count"))[
+            "n"
+        ]
+        live = _messages(direction, start=None if last is None else last + timedelta(days=1))
+        return (n or 0) + live.count()
@@ -0,0 +1,92 @@
+"""
+Changes to a collection since a point in time.
+
+Clients that keep a copy of a collection (contacts, keywords, groups, the
+message logs) can ask the API for the objects created, updated or deleted
+since their last fetch, instead of fetching the whole collection again.
+
+Rows have an `updated_at` timestamp and deleted rows leave a `Tombstone`.
+Some of what the API shows for an object is worked out from other tables
+(e.g. the number of messages that matched a keyword), so `changed` also
+picks up objects whose related rows have changed.
+"""
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from apostello.models import Keyword, Recipient, RecipientGroup, SmsInbound, SmsOutbound, Tombstone
+
+SYNCED_MODELS = (Keyword, Recipient, RecipientGroup, SmsInbound, SmsOutbound)
+# tombstones are kept this long, clients that are further behind must fetch everything again:
+TOMBSTONE_DAYS = 30
+
+
+def touch(model, pks):
+    """Mark the rows of `model` with primary keys `pks` as changed, without sending signals."""
+    pks = list(pks)
+    if pks:
+        model.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+
+def touch_m2m(model, instance, action, pk_set, through):
+    """
+    Mark the `model` side of a many to many change as changed.
+
+    Takes the arguments of the `m2m_changed` signal, from either side of the
+    relation.
+    """
+    if isinstance(instance, model):
+        if action.startswith("post_"):
+            touch(model, [instance.pk])
+    elif action in ("post_add", "post_remove"):
+        touch(model, pk_set)
+    elif action == "pre_clear":
+        # the rows that are about to be unlinked are not in the signal:
+        src = next(f for f in through._meta.fields if f.related_model is type(instance))
+        dst = next(f for f in through._meta.fields if f.related_model is model)
+        touch(model, through.objects.filter(**{src.attname: instance.pk}).values_list(dst.attname, flat=True))
+
+
+def is_expired(since):
+    """Are the tombstones we would need to answer for `since` gone?"""
+    return since < timezone.now() - timedelta(days=TOMBSTONE_DAYS)
+
+
+def changed(queryset, since):
+    """Rows of `queryset` created or changed after `since`."""
+    model = queryset.model
+    if model is RecipientGroup and (
+        Recipient.objects.filter(updated_at__gt=since).exists() or Tombstone.deleted_since(Recipient, since)
+    ):
+        # every group lists its non-members, so any change to a contact changes all of them:
+        return queryset
+    if model is SmsInbound and Tombstone.deleted_since(Recipient, since):
+        # the deleted contact's number is gone, so we cannot tell which messages were from them:
+        return queryset
+    q = Q(updated_at__gt=since)
+    if model is Recipient:
+        # last message received from the contact:
+        q |= Q(number__in=SmsInbound.objects.filter(updated_at__gt=since).values("sender_num"))
+    elif model is Keyword:
+        now = timezone.now()
+        # keywords that have started or ended, and keywords whose matched message counts have changed:
+        q |= Q(activate_time__gt=since, activate_time__lte=now) | Q(deactivate_time__gt=since, deactivate_time__lte=now)
+        q |= Q(keyword__in=SmsInbound.objects.filter(updated_at__gt=since).values("matched_keyword"))
+    elif model is SmsInbound:
+        # messages show the contact they were sent from:
+        q |= Q(sender_num__in=Recipient.objects.filter(updated_at__gt=since).values("number"))
+    elif model is SmsOutbound:
+        # the contact's name is shown with the message:
+        q |= Q(recipient__updated_at__gt=since)
+    return queryset.filter(q)
+
+
+def deleted(model, since):
+    """Primary keys of rows of `model` deleted after `since`."""
+    return Tombstone.deleted_since(model, since)
+
+
+def purge_tombstones():
+    """Remove tombstones that are too old to be used."""
+    Tombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=TOMBSTONE_DAYS)).delete()
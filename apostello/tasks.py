@@ -1,30 +1,81 @@
 import json
 import logging
+from datetime import timedelta
 
 import requests
 from django.conf import settings
 from django.core.cache import cache
 from django.core.mail import get_connection, send_mail
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
-from django_q.tasks import async_task
+from django_q.models import Schedule
+from django_q.tasks import async_task, schedule
 from twilio.base.exceptions import TwilioRestException
 
 from apostello.twilio import get_twilio_client
 from apostello.utils import fetch_default_reply
+from apostello.versions import bump_version
 
 logger = logging.getLogger("apostello")
 
+# number of queued messages sent by each `send_queued_batch` task:
+QUEUED_SMS_BATCH_SIZE = 50
+# sent and failed queued messages are moved out of the queue after:
+QUEUED_SMS_ARCHIVE_DAYS = 1
+# claimed messages that have not been sent after this long are claimed again
+# (e.g. the batch task was lost). Must be longer than the task timeout:
+QUEUED_SMS_CLAIM_TIMEOUT = timedelta(minutes=10)
+
 # sending messages
 
 
 def group_send_message_task(body, group_name, sent_by, eta):
-    """Send message to all members of group."""
-    from apostello.models import Recipient, RecipientGroup
+    """
+    Send message to all members of group.
+
+    Returns the number of members skipped, by reason.
+    """
+    from apostello import audience
+    from apostello.models import QueuedSms, Recipient, RecipientGroup
+
+    members = Recipient.objects.filter(groups__name=group_name, groups__is_archived=False)
+    skipped = audience.skipped_counts(members)
+    if eta is not None:
+        group = RecipientGroup.objects.filter(name=group_name).first()
+        sent = QueuedSms.schedule(audience.sendable(members), body, sent_by, eta, recipient_group=group)
+    else:
+        sent = 0
+        for recipient in audience.sendable(members):
+            recipient.send_message(content=body, group=group_name, sent_by=sent_by)
+            sent += 1
 
-    group = RecipientGroup.objects.filter(name=group_name, is_archived=False)
+    logger.info("Sent message to %s: %s sent, skipped: %s", group_name, sent, skipped)
+    return skipped
 
-    for recipient in Recipient.objects.filter(groups__in=group):
-        recipient.send_message(content=body, group=group_name, sent_by=sent_by, eta=eta)
+
+def target_send_message_task(body, target, sent_by, eta):
+    """
+    Send message to everyone in a combination of groups.
+
+    `target` holds the arguments for `apostello.audience.target`. Returns
+    the number of people skipped, by reason.
+    """
+    from apostello import audience
+    from apostello.models import QueuedSms
+
+    members = audience.target(**target)
+    skipped = audience.skipped_counts(members)
+    if eta is not None:
+        sent = QueuedSms.schedule(audience.sendable(members), body, sent_by, eta)
+    else:
+        sent = 0
+        for recipient in audience.sendable(members):
+            recipient.send_message(content=body, sent_by=sent_by)
+            sent += 1
+
+    logger.info("Sent message to %s: %s sent, skipped: %s", target, sent, skipped)
+    return skipped
 
 
 def recipient_send_message_task(recipient_pk, body, group, sent_by):
@@ -39,8 +90,8 @@ def recipient_send_message_task(recipient_pk, body, group, sent_by):
 
     from apostello.models import SmsOutbound, RecipientGroup
 
-    # if %name% is present, replace:
-    body = recipient.personalise(body)
+    # fill in %name%, %group% etc:
+    body = recipient.personalise(body, group=group or "")
     # send twilio message
     try:
         message = get_twilio_client().messages.create(
@@ -61,11 +112,75 @@ def recipient_send_message_task(recipient_pk, body, group, sent_by):
 
 
 def send_queued_sms():
-    """Check for and send any queued messages."""
+    """
+    Check for any queued messages that are due and queue them for sending.
+
+    Due messages are claimed (their `claimed_at` is set) in batches,
+    skipping any rows locked by another worker, and each batch is sent by
+    its own task. A large scheduled send is then spread over many tasks
+    instead of running into the task timeout, and no message is picked up
+    twice. Messages are only marked as sent once they have been sent, and
+    if a batch task is lost its messages are claimed again after
+    QUEUED_SMS_CLAIM_TIMEOUT.
+    """
     from apostello.models import QueuedSms
 
-    for sms in QueuedSms.objects.filter(sent=False, time_to_send__lte=timezone.now()):
-        sms.send()
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            pks = list(
+                QueuedSms.objects.select_for_update(skip_locked=True)
+                .filter(sent=False, failed=False, time_to_send__lte=now)
+                .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - QUEUED_SMS_CLAIM_TIMEOUT))
+                .values_list("pk", flat=True)[:QUEUED_SMS_BATCH_SIZE]
+            )
+            if not pks:
+                return
+            QueuedSms.objects.filter(pk__in=pks).update(claimed_at=now)
+        async_task("apostello.tasks.send_queued_batch", pks, now)
+
+
+def send_queued_batch(pks, claimed_at=None):
+    """
+    Send a batch of queued messages claimed by `send_queued_sms` at `claimed_at`.
+
+    Messages that have since been sent, or claimed again by another batch,
+    are left alone.
+    """
+    from apostello.models import QueuedSms
+
+    queued = QueuedSms.objects.filter(pk__in=pks, sent=False, failed=False)
+    if claimed_at is not None:
+        queued = queued.filter(claimed_at=claimed_at)
+    for sms in queued.select_related("recipient_group"):
+        sms.deliver()
+
+
+def archive_queued_sms():
+    """
+    Move sent and failed messages from the queue to the history table.
+
+    This keeps the queue down to messages that are still to be sent.
+    Returns the number of messages moved.
+    """
+    from apostello.models import QueuedSms, QueuedSmsHistory
+
+    fields = ["time_to_send", "sent", "failed", "content", "sent_by", "recipient_group_id", "recipient_id"]
+    done = QueuedSms.objects.filter(
+        Q(sent=True) | Q(failed=True), time_to_send__lt=timezone.now() - timedelta(days=QUEUED_SMS_ARCHIVE_DAYS)
+    ).order_by("pk")
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(done.values("pk", *fields)[:1000])
+            if not rows:
+                break
+            QueuedSmsHistory.objects.bulk_create([QueuedSmsHistory(**{f: row[f] for f in fields}) for row in rows])
+            batch = QueuedSms.objects.filter(pk__in=[row["pk"] for row in rows])
+            moved += batch._raw_delete(batch.db)
+
+    logger.info("Archived %s queued messages", moved)
+    return moved
 
 
 def ask_for_name(person_from_pk, sms_body, ask_for_name):
@@ -110,21 +225,114 @@ def check_outgoing_log():
 
 def log_msg_in(p, t, from_pk):
     """Log incoming message."""
-    from apostello.models import Keyword, SmsInbound, Recipient
+    from apostello.models import Keyword, Recipient
 
     from_ = Recipient.objects.get(pk=from_pk)
-    matched_keyword = Keyword.match(p["Body"].strip())
-    SmsInbound.objects.create(
+    _log_msg_in(p, t, str(from_), Keyword.match(p["Body"].strip()))
+
+
+def _log_msg_in(p, t, sender_name, keyword):
+    from apostello.models import Keyword, Recipient, SmsInbound
+
+    # the log check may have imported the message already:
+    sms, created = SmsInbound.objects.update_or_create(
+        sid=p["MessageSid"],
+        defaults={
+            "content": p["Body"],
+            "time_received": t,
+            "sender_name": sender_name,
+            "sender_num": p["From"],
+            "matched_keyword": str(keyword),
+            "matched_colour": Keyword.keyword_colour(keyword),
+        },
+    )
+    Recipient.cache_last_sms(sms)
+    # check log is consistent:
+    async_task("apostello.tasks.check_incoming_log")
+
+
+def _buffer_msg_in(p, t, sender_name, keyword):
+    from apostello import ingest
+    from apostello.models import Keyword
+
+    ingest.buffer_sms(
         sid=p["MessageSid"],
         content=p["Body"],
         time_received=t,
-        sender_name=str(from_),
+        sender_name=sender_name,
         sender_num=p["From"],
-        matched_keyword=str(matched_keyword),
-        matched_colour=Keyword.lookup_colour(p["Body"].strip()),
+        matched_keyword=str(keyword),
+        matched_colour=Keyword.keyword_colour(keyword),
     )
-    # check log is consistent:
-    async_task("apostello.tasks.check_incoming_log")
+
+
+def drain_inbound_buffer():
+    """Write buffered incoming messages to the database (see `apostello.ingest`)."""
+    from apostello import ingest
+
+    ingest.drain_buffer()
+
+
+def schedule_outgoing_log_check():
+    """Check the outgoing log in a minute, unless a check is already scheduled."""
+    if cache.add("outgoing_log_check_scheduled", True, 60):
+        schedule(
+            "apostello.tasks.check_outgoing_log",
+            schedule_type=Schedule.ONCE,
+            next_run=timezone.now() + timedelta(minutes=1),
+        )
+
+
+def _add_to_linked_groups(keyword_pk, recipient_pk):
+    if keyword_pk is None:
+        return
+    from apostello.models import Keyword
+
+    Keyword.objects.get(pk=keyword_pk).add_contact_to_groups(recipient_pk)
+
+
+def process_inbound(msg_params, time_received, contact, keyword, send_name_sms, linked_keyword=None):
+    """
+    Handle everything for an incoming message that can wait until after we have replied.
+
+    `contact` holds the sender's pk, name, number and blocking status and
+    `keyword` the name of the matched keyword, as worked out when the
+    message was received (see `apostello.reply.InboundSms`). A contact
+    without a pk is created here. If `linked_keyword` (a pk) is given, the
+    contact is added to that keyword's linked groups. Each step is run in
+    turn; a step that fails is logged and does not stop the rest.
+    """
+    from apostello.models import Recipient
+
+    sms_body = msg_params["Body"].strip()
+    if contact["pk"] is None:
+        # sender was not known when we replied:
+        recipient, _ = Recipient.objects.get_or_create(
+            number=contact["number"], defaults={"first_name": "Unknown", "last_name": "Person"}
+        )
+        contact = dict(contact, pk=recipient.pk, name=str(recipient))
+
+    steps = [
+        (
+            "log",
+            _buffer_msg_in if settings.SMS_BUFFERED_INGEST else _log_msg_in,
+            (msg_params, time_received, contact["name"], keyword),
+        ),
+        ("slack", sms_to_slack, (sms_body, contact["name"], keyword)),
+        (
+            "blacklist",
+            _blacklist_notify,
+            (contact["number"], contact["name"], contact["is_blocking"], sms_body, keyword),
+        ),
+        ("groups", _add_to_linked_groups, (linked_keyword, contact["pk"])),
+        ("name", ask_for_name, (contact["pk"], sms_body, send_name_sms)),
+        ("outgoing log", schedule_outgoing_log_check, ()),
+    ]
+    for name, step, args in steps:
+        try:
+            step(*args)
+        except Exception:
+            logger.exception("Failed to %s incoming sms %s", name, msg_params.get("MessageSid"))
 
 
 def update_msgs_name(person_pk):
@@ -146,6 +354,13 @@ def cleanup_expired_sms():
     logs.cleanup_expired_sms()
 
 
+def purge_tombstones():
+    """Remove old records of deleted objects."""
+    from apostello import sync
+
+    sync.purge_tombstones()
+
+
 def delete_from_twilio(sid):
     """
     Permanently delete a message from twilio. This cannot be undone.
@@ -181,22 +396,26 @@ def blacklist_notify(recipient_pk, sms_body, keyword):
     from apostello.models import Recipient
 
     recipient = Recipient.objects.get(pk=recipient_pk)
+    _blacklist_notify(str(recipient.number), str(recipient), recipient.is_blocking, sms_body, keyword)
+
+
+def _blacklist_notify(number, name, is_blocking, sms_body, keyword):
     if keyword == "start":
         return
     if keyword == "stop":
         async_task(
             "apostello.tasks.notify_office_mail",
             "[Apostello] Blacklist Update",
-            "{0} ({1}) is now blocking us".format(str(recipient.number), str(recipient)),
+            "{0} ({1}) is now blocking us".format(number, name),
         )
         return
-    if recipient.is_blocking:
+    if is_blocking:
         email_body = (
             "{0} has blacklisted us in the past but has just sent "
             "this message:\n\n\t{1}\n\n"
             "You may need to email them as we cannot currently reply to them."
         )
-        email_body.format(str(recipient), sms_body)
+        email_body = email_body.format(name, sms_body)
         async_task("apostello.tasks.notify_office_mail", "[Apostello] Blacklist Receipt Notice", email_body)
 
 
@@ -310,5 +529,31 @@ def populate_keyword_response_count(pk=None):
     else:
         keywords = [Keyword.objects.get(pk=pk)]
     for k in keywords:
-        cache.set("keyword_{0}_num_resps".format(pk), k.fetch_matches().count(), 600)
-        cache.set("keyword_{0}_num_arch_resps".format(pk), k.fetch_archived_matches().count(), 600)
+        cache.set("keyword_{0}_num_resps".format(k.pk), k.fetch_matches().count(), 600)
+        cache.set("keyword_{0}_num_arch_resps".format(k.pk), k.fetch_archived_matches().count(), 600)
+    # the counts are part of the keyword:
+    bump_version(Keyword)
+
+
+# Statistics
+def update_daily_stats():
+    """Roll up message counts for days that have closed."""
+    from apostello import stats
+
+    stats.update_daily_stats()
+
+
+# Graphs
+def render_graph(name, **kwargs):
+    """Render a graph into the graph cache."""
+    from graphs import graph_cache
+
+    graph_cache.render_graph(name, **kwargs)
+
+
+def render_graphs():
+    """Re-render any cached graphs that are out of date."""
+    from graphs import graph_cache
+
+    for name, kwargs in graph_cache.PRERENDERED_GRAPHS:
+        graph_cache.get_graph(name, **kwargs)
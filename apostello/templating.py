@@ -0,0 +1,75 @@
+"""
+Message templates.
+
+Message bodies and replies can contain placeholders that are filled in
+for each recipient:
+
+    %name%       recipient's first name
+    %last_name%  recipient's last name
+    %group%      name of the group the message was sent to
+    %keyword%    keyword the incoming message matched
+
+A template is split into literal and placeholder parts once (and
+compiled templates are cached), so rendering the same message for every
+member of a group only costs a join per recipient.
+"""
+import re
+from functools import lru_cache
+
+from apostello import segments
+
+# placeholder -> name of the value that replaces it:
+PLACEHOLDERS = {"%name%": "name", "%last_name%": "last_name", "%group%": "group", "%keyword%": "keyword"}
+
+_placeholder_re = re.compile("({0})".format("|".join(re.escape(p) for p in PLACEHOLDERS)))
+
+
+class Template:
+    """A message split into literal and placeholder parts."""
+
+    __slots__ = ("source", "parts", "names", "literal_length")
+
+    def __init__(self, source):
+        self.source = source
+        # literals are at even indices, placeholders at odd indices:
+        self.parts = tuple(_placeholder_re.split(source))
+        self.names = tuple(PLACEHOLDERS[p] for p in self.parts[1::2])
+        self.literal_length = sum(len(s) for s in self.parts[0::2])
+
+    def _values(self, context):
+        """Values for each placeholder. Placeholders missing from `context` are left as they are."""
+        return [context.get(name, placeholder) for name, placeholder in zip(self.names, self.parts[1::2])]
+
+    def render(self, **context):
+        """Fill in the placeholders."""
+        if not self.names:
+            return self.source
+        parts = list(self.parts)
+        parts[1::2] = self._values(context)
+        return "".join(parts)
+
+    def length(self, **context):
+        """Number of characters in the rendered message, without rendering it."""
+        return self.literal_length + sum(len(v) for v in self._values(context))
+
+    def measure(self, **context):
+        """Encoding, length and number of sms of the rendered message (see `apostello.segments`)."""
+        return segments.measure(self.render(**context))
+
+    def segment_count(self, **context):
+        """Number of sms needed to send the rendered message."""
+        return self.measure(**context).segments
+
+    def __repr__(self):
+        return "<Template {0!r}>".format(self.source)
+
+
+@lru_cache(maxsize=512)
+def compile_template(source):
+    """Compile `source`, reusing the compiled template if we have seen it before."""
+    return Template(source)
+
+
+def render(source, **context):
+    """Fill in the placeholders in `source`."""
+    return compile_template(source).render(**context)
@@ -1,4 +1,6 @@
-from functools import wraps
+from functools import lru_cache, wraps
+from time import perf_counter
+from urllib.parse import urljoin
 
 from django.conf import settings
 from django.http import HttpRequest, HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed
@@ -6,6 +8,7 @@ from django.views.decorators.csrf import csrf_exempt
 from twilio.request_validator import RequestValidator
 from twilio.rest import Client
 
+from apostello import metrics
 from site_config.models import ConfigurationError, SiteConfiguration
 
 
@@ -14,6 +17,18 @@ def get_twilio_client():
     return Client(twilio_settings["sid"], twilio_settings["auth_token"])
 
 
+@lru_cache(maxsize=4)
+def get_request_validator(auth_token):
+    """Validator for webhook signatures, kept for each auth token."""
+    return RequestValidator(auth_token)
+
+
+@lru_cache(maxsize=16)
+def webhook_url(base_url, full_path):
+    """Address Twilio used to call a webhook (see `settings.TWILIO_WEBHOOK_BASE_URL`)."""
+    return urljoin(base_url, full_path)
+
+
 def twilio_view(f):
     """
     Copied from: https://github.com/rdegges/django-twilio/blob/master/django_twilio/decorators.py
@@ -68,20 +83,23 @@ def twilio_view(f):
                 return HttpResponseNotAllowed(request.method)
 
             # Forgery check
+            started = perf_counter()
             try:
                 twilio_settings = SiteConfiguration.get_twilio_settings()
-                validator = RequestValidator(twilio_settings["auth_token"])
-                url = request.build_absolute_uri()
+                validator = get_request_validator(twilio_settings["auth_token"])
+                if settings.TWILIO_WEBHOOK_BASE_URL:
+                    url = webhook_url(settings.TWILIO_WEBHOOK_BASE_URL, request.get_full_path())
+                else:
+                    url = request.build_absolute_uri()
                 signature = request.META["HTTP_X_TWILIO_SIGNATURE"]
             except (AttributeError, KeyError, ConfigurationError):
                 return HttpResponseForbidden()
 
-            if request.method == "POST":
-                if not validator.validate(url, request.POST, signature):
-                    return HttpResponseForbidden()
-            if request.method == "GET":
-                if not validator.validate(url, request.GET, signature):
-                    return HttpResponseForbidden()
+            params = request.POST if request.method == "POST" else request.GET
+            valid = validator.validate(url, params, signature)
+            metrics.observe("twilio_validation", perf_counter() - started)
+            if not valid:
+                return HttpResponseForbidden()
 
         response = f(request_or_self, *args, **kwargs)
 
@@ -10,8 +10,7 @@ def fetch_default_reply(msg=""):
     """Fetch default reply from database."""
     from site_config.models import DefaultResponses
 
-    replies = DefaultResponses.get_solo().__dict__
-    return replies[msg]
+    return getattr(DefaultResponses.get_solo(), msg)
 
 
 def retry_request(url, http_method, *args, **kwargs):
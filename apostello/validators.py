@@ -2,6 +2,8 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 
+from apostello import segments
+
 TWILIO_STOP_WORDS = ("stop", "stopall", "unsubscribe", "cancel", "end", "quit")
 TWILIO_START_WORDS = ("start", "yes")
 TWILIO_INFO_WORDS = ("help", "info")
@@ -48,18 +50,29 @@ def no_overlap_keyword(value):
 
 
 def less_than_sms_char_limit(value):
-    """Ensure message is less than the maximum character limit."""
+    """
+    Ensure message is less than the maximum character limit.
+
+    The message is measured as it is sent (see `apostello.segments`), so
+    it also may not need more sms than a message of `sms_char_limit` GSM
+    characters - e.g. when a character forces it into UCS-2.
+    """
     from site_config.models import SiteConfiguration
 
     s = SiteConfiguration.get_solo()
     sms_char_lim = s.sms_char_limit
 
-    if "%name%" in value:
-        # if `%name%` in value, then adjust limit to handle substitutions
-        sms_char_lim = sms_char_lim - settings.MAX_NAME_LENGTH + len("%name%")
+    # `%name%` is replaced with the contact's first name when sent:
+    sms = segments.measure(value.replace("%name%", "x" * settings.MAX_NAME_LENGTH))
 
-    if len(value) > sms_char_lim:
+    if sms.characters > sms_char_lim:
         raise ValidationError("You have exceeded the maximum char limit of {0}.".format(sms_char_lim))
+    max_segments = segments.segments_for_length(sms_char_lim)
+    if sms.segments > max_segments:
+        raise ValidationError(
+            "This message needs {0} sms, the maximum is {1}"
+            " (messages with non GSM characters fit fewer characters in each sms).".format(sms.segments, max_segments)
+        )
 
 
 def validate_starts_with_plus(value):
@@ -0,0 +1,43 @@
+"""
+Version stamps for models.
+
+Every save or delete of a tracked model stores a new stamp (the current
+timestamp) in the cache. Anything derived from a model's rows can be cached
+against that stamp and is invalidated for free when the rows change.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def version_key(model):
+    """Cache key holding the version stamp of `model`."""
+    return "model_version__{0}".format(model._meta.label_lower)
+
+
+def bump_version(model):
+    """Mark the rows of `model` as changed."""
+    cache.set(version_key(model), time.time(), None)
+
+
+def get_versions(*models):
+    """
+    Fetch the version stamps of `models` with a single cache read.
+
+    If a stamp is missing (e.g. the cache has been cleared), a new one is
+    created so that anything cached before the clear is not reused.
+    """
+    keys = [version_key(m) for m in models]
+    found = cache.get_many(keys)
+    missing = [k for k in keys if found.get(k) is None]
+    if missing:
+        now = time.time()
+        for k in missing:
+            cache.add(k, now, None)
+        found.update(cache.get_many(missing))
+    return [found[k] for k in keys]
+
+
+def get_version(*models):
+    """Combined version stamp of `models`, i.e. the most recent change."""
+    return max(get_versions(*models))
@@ -1,9 +1,11 @@
 import logging
+from time import perf_counter
 
+from django.conf import settings
 from django.http import HttpResponse
 from twilio.twiml.messaging_response import MessagingResponse
 
-from apostello.reply import InboundSms
+from apostello import metrics, reply
 from apostello.twilio import twilio_view
 from site_config.models import SiteConfiguration
 
@@ -17,15 +19,39 @@ def sms(request):
 
     This is the start of the message processing pipeline.
     """
+    started = perf_counter()
     logger.info("Received new sms")
     r = MessagingResponse()
-    msg = InboundSms(request.POST)
+    sid = request.POST.get("MessageSid")
+    if sid and not reply.claim_sms(sid):
+        # Twilio has retried the webhook, don't handle the message twice:
+        logger.info("Already received sms %s", sid)
+        reply_content = reply.previous_reply(sid)
+    else:
+        try:
+            reply_content = handle_sms(request.POST)
+        except Exception:
+            if sid:
+                reply.release_sms(sid)
+            raise
+        if sid:
+            reply.remember_reply(sid, reply_content)
+
+    if reply_content:
+        logger.info("Add reply (%s) to response", reply_content)
+        r.message(reply_content)
+
+    logger.info("Return response to Twilio")
+    metrics.observe("sms_webhook", perf_counter() - started)
+    return HttpResponse(str(r), content_type="application/xml")
+
+
+def handle_sms(msg_params):
+    """Process an incoming message and return the reply, if any."""
+    msg = reply.InboundSms(msg_params, fast_path=settings.SMS_FAST_PATH)
     msg.start_bg_tasks()
 
     config = SiteConfiguration.get_solo()
     if msg.reply and not config.disable_all_replies:
-        logger.info("Add reply (%s) to response", msg.reply)
-        r.message(msg.reply)
-
-    logger.info("Return response to Twilio")
-    return HttpResponse(str(r), content_type="application/xml")
+        return msg.reply
+    return ""
@@ -103,6 +103,21 @@ api_act_send_group =
     "/api/v2/actions/sms/send/group/"
 
 
+api_act_send_preview : String
+api_act_send_preview =
+    "/api/v2/actions/sms/send/preview/"
+
+
+api_act_send_target : String
+api_act_send_target =
+    "/api/v2/actions/sms/send/target/"
+
+
+api_act_sms_cost_estimate : String
+api_act_sms_cost_estimate =
+    "/api/v2/actions/sms/cost/"
+
+
 api_act_update_group_members : Int -> String
 api_act_update_group_members pk =
     "/api/v2/actions/group/update_members/" ++ Future.String.fromInt pk ++ "/"
@@ -145,6 +160,11 @@ api_keywords keyword =
            )
 
 
+api_metrics : String
+api_metrics =
+    "/api/v2/metrics/"
+
+
 api_out_log : String
 api_out_log =
     "/api/v2/sms/out/"
@@ -229,6 +249,11 @@ api_users =
     "/api/v2/users/"
 
 
+api_wall_feed : String
+api_wall_feed =
+    "/api/v2/sms/wall/"
+
+
 google_callback : String
 google_callback =
     "/accounts/google/login/callback/"
@@ -0,0 +1,99 @@
+"""
+Cache of rendered graphs.
+
+Rendered SVGs are stored in the cache along with the version stamp of the
+data they were drawn from. A graph is served from the cache until its data
+changes, at which point it is re-rendered - either inline, or in the
+background while the previous render is served.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.utils import timezone
+from django_q.tasks import async_task
+
+from apostello.models import Keyword, Recipient, RecipientGroup, SmsInbound, SmsOutbound
+from apostello.versions import get_version
+from graphs import renderers
+from graphs.sms_freq import GRAPH_WINDOWS
+
+# models each graph is drawn from:
+GRAPH_DEPENDENCIES = {
+    "recent": (SmsInbound, SmsOutbound),
+    "contacts": (Recipient,),
+    "groups": (RecipientGroup,),
+    "keywords": (Keyword, SmsInbound),
+    "sms_totals": (SmsInbound, SmsOutbound),
+    "incoming_by_contact": (Recipient, SmsInbound),
+    "outgoing_by_contact": (Recipient, SmsOutbound),
+}
+
+# graphs (and their arguments) that are kept rendered by `apostello.tasks.render_graphs`:
+PRERENDERED_GRAPHS = [("recent", {"days": days}) for days in GRAPH_WINDOWS] + [
+    (name, {}) for name in GRAPH_DEPENDENCIES if name != "recent"
+]
+
+# served in place of a graph that has never been rendered:
+PLACEHOLDER_SVG = b'<svg xmlns="http://www.w3.org/2000/svg"></svg>'
+
+GRAPH_TIMEOUT = 24 * 60 * 60
+
+
+def graph_key(name, **kwargs):
+    """Cache key for a rendered graph."""
+    options = "__".join("{0}_{1}".format(k, v) for k, v in sorted(kwargs.items()))
+    return "graph__{0}__{1}".format(name, options)
+
+
+def data_version(name):
+    """Version stamp of the data behind a graph."""
+    return get_version(*GRAPH_DEPENDENCIES[name])
+
+
+def is_fresh(name, entry):
+    """Check a cached graph still matches its data."""
+    return entry["version"] == data_version(name) and entry["date"] == timezone.localdate()
+
+
+def render_graph(name, **kwargs):
+    """Render a graph and store it in the cache."""
+    # read the version first, so changes made while rendering trigger another render
+    version = data_version(name)
+    today = timezone.localdate()
+    svg = getattr(renderers, name)(**kwargs)
+    # graphs are re-rendered each day (the time window moves), so the date is part of the etag:
+    etag = "{0}{1}{2}".format(graph_key(name, **kwargs), version, today.isoformat())
+    entry = {
+        "version": version,
+        "date": today,
+        "rendered_at": time.time(),
+        "etag": hashlib.md5(etag.encode("utf-8")).hexdigest(),
+        "svg": svg,
+    }
+    cache.set(graph_key(name, **kwargs), entry, GRAPH_TIMEOUT)
+    cache.delete(graph_key(name, **kwargs) + "__rendering")
+    return entry
+
+
+def request_render(name, **kwargs):
+    """Queue a background render, unless one is already queued."""
+    if cache.add(graph_key(name, **kwargs) + "__rendering", True, 60):
+        async_task("apostello.tasks.render_graph", name, **kwargs)
+
+
+def get_graph(name, inline=True, **kwargs):
+    """
+    Fetch a rendered graph.
+
+    If the cached graph is out of date it is re-rendered inline or, if
+    `inline` is False, in the background while the out of date graph is
+    returned. Returns None if no graph is available yet.
+    """
+    entry = cache.get(graph_key(name, **kwargs))
+    if entry is not None and is_fresh(name, entry):
+        return entry
+    if inline:
+        return render_graph(name, **kwargs)
+    request_render(name, **kwargs)
+    return cache.get(graph_key(name, **kwargs), entry)
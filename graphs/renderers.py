@@ -1,27 +1,26 @@
 import pygal
-from django.utils import timezone
+from django.db.models import Count
 from pygal.style import CleanStyle
 
-from apostello.models import Keyword, Recipient, RecipientGroup, SmsInbound, SmsOutbound
-from graphs.sms_freq import sms_graph_data
+from apostello import stats
+from apostello.models import DailySmsStats, Keyword, Recipient, RecipientGroup
+from graphs.sms_freq import DEFAULT_WINDOW, graph_dates, sms_graph_series
+
+# maximum number of entries in a treemap or pie chart, the rest are shown as "Others":
+MAX_GRAPH_ITEMS = 50
 
 clean_style_large_text = CleanStyle(legend_font_size=30, tooltip_font_size=30)
 
 
-def recent():
+def recent(days=DEFAULT_WINDOW):
     """Render the recent SMS activity graph on home page."""
     bar_chart = pygal.Bar(
         height=200, style=CleanStyle, margin=15, spacing=5, show_y_labels=True, x_label_rotation=90, legend_box_size=10
     )
-    bar_chart.add("In", sms_graph_data(direction="in"))
-    bar_chart.add("Out", sms_graph_data(direction="out"))
-    td = timezone.now()
-    xlabels = []
-    for x in range(-30, 1):
-        delta = timezone.timedelta(days=x)
-        today = td + delta
-        xlabels.append(today.strftime("%d %b"))
-        bar_chart.x_labels = xlabels
+    smsdata = sms_graph_series(days=days)
+    bar_chart.add("In", smsdata["in"])
+    bar_chart.add("Out", smsdata["out"])
+    bar_chart.x_labels = [d.strftime("%d %b") for d in graph_dates(days)]
 
     return bar_chart.render()
 
@@ -42,11 +41,26 @@ def contacts():
     return pie_chart.render(legend_box_size=40, legend_at_bottom=True, legend_at_bottom_columns=3)
 
 
+def _top_n(counts, n=MAX_GRAPH_ITEMS):
+    """
+    Keep the `n` largest (label, count) pairs.
+
+    Anything that does not make the cut is summed into an "Others" entry.
+    """
+    counts = sorted(counts, key=lambda x: x[1], reverse=True)
+    top, rest = counts[:n], counts[n:]
+    others = sum(c for _, c in rest)
+    if others:
+        top.append(("Others", others))
+    return top
+
+
 def groups():
     """Render tree map of group size."""
     treemap = pygal.Treemap(style=clean_style_large_text, margin=0)
-    for grp in RecipientGroup.objects.filter(is_archived=False):
-        treemap.add(str(grp), [grp.recipient_set.all().count()])
+    sizes = RecipientGroup.objects.filter(is_archived=False).annotate(n=Count("recipient")).values_list("name", "n")
+    for name, n in _top_n(sizes):
+        treemap.add(name, [n])
 
     return treemap.render(show_legend=False)
 
@@ -56,28 +70,42 @@ def keywords():
     pie_chart = pygal.Pie(
         inner_radius=0.6, style=clean_style_large_text, margin=0, value_formatter=lambda x: "{}".format(x)
     )
-    for k in Keyword.objects.filter(is_archived=False):
-        pie_chart.add(str(k), k.num_matches + k.num_archived_matches)
+    matches = stats.totals(
+        DailySmsStats.IN, DailySmsStats.KEYWORD, values=Keyword.objects.filter(is_archived=False).values("keyword")
+    )
+    for keyword, n in _top_n(matches.items()):
+        pie_chart.add(keyword, n)
 
     return pie_chart.render(legend_box_size=40, legend_at_bottom=True, legend_at_bottom_columns=3)
 
 
-def incoming_by_contact():
-    """Render tree map of incoming messages, grouped by user."""
+def _contacts_treemap(direction):
+    """Render tree map of messages, grouped by contact."""
     treemap = pygal.Treemap(style=clean_style_large_text, margin=0)
-    for con in Recipient.objects.filter(is_archived=False):
-        treemap.add(str(con), SmsInbound.objects.filter(sender_num=str(con.number)).count())
+    counts = stats.totals(
+        direction, DailySmsStats.CONTACT, values=Recipient.objects.filter(is_archived=False).values("number")
+    )
+    top = _top_n(counts.items())
+    names = {
+        str(con.number): str(con)
+        for con in Recipient.objects.filter(number__in=[num for num, _ in top]).only(
+            "first_name", "last_name", "number"
+        )
+    }
+    for num, n in top:
+        treemap.add(names.get(num, num), n)
 
     return treemap.render(show_legend=False)
 
 
+def incoming_by_contact():
+    """Render tree map of incoming messages, grouped by user."""
+    return _contacts_treemap(DailySmsStats.IN)
+
+
 def outgoing_by_contact():
     """Render tree map of outgoing messages, grouped by user."""
-    treemap = pygal.Treemap(style=clean_style_large_text, margin=0)
-    for con in Recipient.objects.filter(is_archived=False):
-        treemap.add(str(con), SmsOutbound.objects.filter(recipient=con).count())
-
-    return treemap.render(show_legend=False)
+    return _contacts_treemap(DailySmsStats.OUT)
 
 
 def sms_totals():
@@ -86,7 +114,7 @@ def sms_totals():
         inner_radius=0.6, style=clean_style_large_text, margin=0, value_formatter=lambda x: "{}".format(x)
     )
 
-    pie_chart.add("Sent", SmsOutbound.objects.all().count())
-    pie_chart.add("Received", SmsInbound.objects.all().count())
+    pie_chart.add("Sent", stats.total(DailySmsStats.OUT))
+    pie_chart.add("Received", stats.total(DailySmsStats.IN))
 
     return pie_chart.render(legend_box_size=40, legend_at_bottom=True, legend_at_bottom_columns=2)
@@ -1,48 +1,59 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
 
-from apostello.models import SmsInbound, SmsOutbound
+from apostello import stats
+from apostello.models import DailySmsStats, SmsInbound, SmsOutbound
+from apostello.versions import get_version
+
+# windows (in days) that can be requested for the activity graph:
+GRAPH_WINDOWS = (7, 30, 90, 365)
+DEFAULT_WINDOW = 30
+
+
+def graph_dates(days=DEFAULT_WINDOW):
+    """
+    Local dates covered by the activity graph.
+
+    The window covers the past `days` days plus today, oldest first.
+    """
+    with timezone.override(settings.TIME_ZONE):
+        today = timezone.localdate()
+    return [today - timedelta(days=x) for x in range(days, -1, -1)]
 
 
-def sms_graph_data(direction="in"):
+def sms_graph_series(days=DEFAULT_WINDOW):
     """
-    Calculate the SMS activity from the past 30 days.
+    Calculate the SMS activity over the past `days` days.
 
-    Returns a list of ints - one for each day. Value is the number of messages.
+    Returns a dict with an "in" and an "out" list of ints - one for each day.
+    Value is the number of messages. Days follow the configured time zone.
     """
-    if direction == "in":
-        model_class = SmsInbound
-        cache_id = "igd"
-    elif direction == "out":
-        model_class = SmsOutbound
-        cache_id = "ogd"
-
-    smsdata = cache.get(cache_id)
+    if days not in GRAPH_WINDOWS:
+        raise ValueError("Unsupported graph window: {0}".format(days))
+
+    dates = graph_dates(days)
+    version = get_version(SmsInbound, SmsOutbound)
+    cache_key = "sms_graph_data__{0}__{1}__{2}".format(days, dates[-1], version)
+    smsdata = cache.get(cache_key)
     if smsdata is None:
-        td = timezone.now()
-        # grab all the message timestamps from last 31 days as a list
-        if cache_id == "ogd":
-            sms_list = list(
-                model_class.objects.filter(time_sent__gt=td - timezone.timedelta(days=31)).values_list(
-                    "time_sent", flat=True
-                )
-            )
-        elif cache_id == "igd":
-            sms_list = list(
-                model_class.objects.filter(time_received__gt=td - timezone.timedelta(days=31)).values_list(
-                    "time_received", flat=True
-                )
-            )
-        # count sms per day
-        smsdata = []
-        for x in range(-30, 1):
-            delta = timezone.timedelta(days=x)
-            today = td + delta
-            num_of_sms = len(
-                [x for x in sms_list if x.year == today.year and x.month == today.month and x.day == today.day]
-            )
-            smsdata.append(num_of_sms)
-
-        cache.set(cache_id, smsdata, 5 * 60)
+        with timezone.override(settings.TIME_ZONE):
+            smsdata = {
+                "in": stats.daily_counts(DailySmsStats.IN, dates),
+                "out": stats.daily_counts(DailySmsStats.OUT, dates),
+            }
+        cache.set(cache_key, smsdata, 24 * 60 * 60)
 
     return smsdata
+
+
+def sms_graph_data(direction="in", days=DEFAULT_WINDOW):
+    """
+    Calculate the SMS activity over the last `days` days.
+
+    Returns a list of ints - one for each day in the window. Value is the
+    number of messages.
+    """
+    return sms_graph_series(days=days)[direction]
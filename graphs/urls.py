@@ -2,11 +2,21 @@ from django.conf.urls import url
 
 from graphs import renderers as r
 from graphs import views as v
+from graphs.sms_freq import DEFAULT_WINDOW
 
 app_name = "graphs"
 
 urlpatterns = [
-    url(r"^recent/", v.GraphView.as_view(graph_renderer=r.recent, required_perms=[])),
+    url(
+        r"^recent/(?P<days>7|30|90|365)/$",
+        v.GraphView.as_view(graph_renderer=r.recent, render_inline=False, required_perms=[]),
+    ),
+    # same graph as the default window, so it is kept rendered:
+    url(
+        r"^recent/",
+        v.GraphView.as_view(graph_renderer=r.recent, render_inline=False, required_perms=[]),
+        {"days": DEFAULT_WINDOW},
+    ),
     url(r"^contacts/", v.GraphView.as_view(graph_renderer=r.contacts)),
     url(r"^groups/", v.GraphView.as_view(graph_renderer=r.groups)),
     url(r"^keywords/", v.GraphView.as_view(graph_renderer=r.keywords)),
@@ -1,13 +1,39 @@
 from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 
 from apostello.views import SimpleView
+from graphs.graph_cache import PLACEHOLDER_SVG, get_graph
 
 
 class GraphView(SimpleView):
-    """View to wrap graphs in required permissions."""
+    """
+    View to wrap graphs in required permissions.
+
+    Graphs are served from the graph cache with an ETag and Last-Modified
+    header, so browsers only download a graph again when it is re-rendered.
+    """
 
     graph_renderer = None
+    # if False, out of date graphs are re-rendered in the background instead of during the request:
+    render_inline = True
 
     def get(self, request, *args, **kwargs):
         """Handle get requests."""
-        return HttpResponse(self.graph_renderer(), content_type="image/svg+xml")
+        # graph urls only capture numeric options, e.g. the number of days:
+        graph_kwargs = {k: int(v) for k, v in kwargs.items()}
+        graph = get_graph(self.graph_renderer.__name__, inline=self.render_inline, **graph_kwargs)
+        if graph is None:
+            response = HttpResponse(PLACEHOLDER_SVG, content_type="image/svg+xml")
+            patch_cache_control(response, no_store=True)
+            return response
+
+        etag = '"{0}"'.format(graph["etag"])
+        last_modified = int(graph["rendered_at"])
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = HttpResponse(graph["svg"], content_type="image/svg+xml")
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
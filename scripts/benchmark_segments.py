@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""
+Benchmark sms segment counting over a generated corpus of messages.
+
+Usage:
+    python scripts/benchmark_segments.py [number of messages]
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apostello.segments import GSM_BASIC, GSM_EXTENDED, measure  # noqa: E402
+
+# GSM only, GSM with extension characters, and messages that need UCS-2:
+ALPHABETS = {
+    "gsm": "".join(sorted(GSM_BASIC)),
+    "gsm_extended": "".join(sorted(GSM_BASIC)) + "".join(sorted(GSM_EXTENDED)) * 5,
+    "ucs2": "".join(sorted(GSM_BASIC)) + "Привет你好🙂",
+}
+
+
+def corpus(alphabet, n, seed=42):
+    rand = random.Random(seed)
+    return ["".join(rand.choice(alphabet) for _ in range(rand.randint(1, 480))) for _ in range(n)]
+
+
+def main(n):
+    print("{0:<14}{1:>12}{2:>16}".format("corpus", "msgs/sec", "total segments"))
+    for name, alphabet in ALPHABETS.items():
+        msgs = corpus(alphabet, n)
+        seconds = min(timeit.repeat(lambda: [measure(m) for m in msgs], number=1, repeat=3))
+        total = sum(measure(m).segments for m in msgs)
+        print("{0:<14}{1:>12.0f}{2:>16}".format(name, n / seconds, total))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -1,6 +1,7 @@
 """Common settings module."""
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+from datetime import timedelta
 
 APPEND_SLASH = True
 
@@ -172,6 +173,30 @@ SMS_CHAR_LIMIT = 160 - MAX_NAME_LENGTH + len("{name}")
 # particular countries:
 # https://www.twilio.com/help/faq/voice/what-are-global-permissions-and-why-do-they-exist
 COUNTRY_CODE = os.environ.get("COUNTRY_CODE", "44")
+# Number of sms Twilio sends per second from our number (1 for a long code).
+# Used to estimate how long a send will take:
+TWILIO_SEND_RATE = os.environ.get("TWILIO_SEND_RATE", 1)
+try:
+    TWILIO_SEND_RATE = float(TWILIO_SEND_RATE)
+except ValueError:
+    TWILIO_SEND_RATE = 1
+if not TWILIO_SEND_RATE > 0:
+    TWILIO_SEND_RATE = 1
+
+# Address Twilio calls our webhooks on (e.g. "https://sms.example.com"), used
+# to check webhook signatures. If not set, the address of each request is used:
+TWILIO_WEBHOOK_BASE_URL = os.environ.get("TWILIO_WEBHOOK_BASE_URL", "")
+
+# Reply to incoming sms as quickly as possible, leaving new contacts and
+# keyword linked groups to be handled in the background:
+SMS_FAST_PATH = os.environ.get("SMS_FAST_PATH", "").lower() in ("1", "true", "yes")
+
+# Buffer incoming sms in Redis and write them to the database in batches,
+# for events with a very large number of incoming messages:
+SMS_BUFFERED_INGEST = os.environ.get("SMS_BUFFERED_INGEST", "").lower() in ("1", "true", "yes")
+
+# objects changed this long before a sync or live wall cursor are sent again:
+CURSOR_OVERLAP = timedelta(seconds=2)
 
 NO_ACCESS_WARNING = (
     "You do not have access to that page. " "If you believe you are seeing it in error please contact the office"
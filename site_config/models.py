@@ -1,17 +1,64 @@
+from copy import deepcopy
+from time import monotonic
+
 from django.contrib.auth.models import User
-from django.core.cache import cache
 from django.db import models
 from phonenumber_field.modelfields import PhoneNumberField
 from solo.models import SingletonModel
 
 from apostello.validators import less_than_sms_char_limit, validate_starts_with_plus
+from apostello.versions import bump_version, get_version
+
+# seconds a process uses its copy of a singleton before checking it is still current:
+SINGLETON_MEMORY_TTL = 5
 
 
 class ConfigurationError(Exception):
     pass
 
 
-class SiteConfiguration(SingletonModel):
+class CachedSingletonModel(SingletonModel):
+    """
+    Singleton with a per process cache in front of django-solo's cache.
+
+    `get_solo` returns a copy of the instance held in memory for up to
+    SINGLETON_MEMORY_TTL seconds. After that, the model's version stamp is
+    checked and the instance is only fetched again if it has been saved
+    since. Saving bumps the version stamp, so other processes pick up the
+    change within SINGLETON_MEMORY_TTL seconds.
+    """
+
+    # model class -> (expires, version, instance)
+    _memory = {}
+
+    def save(self, *args, **kwargs):
+        super(CachedSingletonModel, self).save(*args, **kwargs)
+        bump_version(type(self))
+        self._memory.pop(type(self), None)
+
+    def delete(self, *args, **kwargs):
+        super(CachedSingletonModel, self).delete(*args, **kwargs)
+        bump_version(type(self))
+        self._memory.pop(type(self), None)
+
+    @classmethod
+    def get_solo(cls):
+        now = monotonic()
+        expires, version, obj = cls._memory.get(cls, (0, None, None))
+        if now < expires:
+            return deepcopy(obj)
+        current_version = get_version(cls)
+        if obj is None or version != current_version:
+            obj = super(CachedSingletonModel, cls).get_solo()
+        cls._memory[cls] = (now + SINGLETON_MEMORY_TTL, current_version, obj)
+        # callers get their own copy, so changes they do not save stay with them:
+        return deepcopy(obj)
+
+    class Meta:
+        abstract = True
+
+
+class SiteConfiguration(CachedSingletonModel):
     """
     Stores site wide configuration options.
 
@@ -118,10 +165,6 @@ class SiteConfiguration(SingletonModel):
         """Pretty representation."""
         return "Site Configuration"
 
-    def save(self, *args, **kwargs):
-        super(SiteConfiguration, self).save(*args, **kwargs)
-        cache.delete("twilio_settings")
-
     def is_twilio_setup(self):
         vals = [self.twilio_account_sid, self.twilio_auth_token, self.twilio_from_num, self.twilio_sending_cost]
         return all([x is not None for x in vals])
@@ -136,24 +179,18 @@ class SiteConfiguration(SingletonModel):
         if not config.is_twilio_setup():
             raise ConfigurationError("Twilio Not Setup Yet.")
 
-        cached = cache.get("twilio_settings")
-        if cached is None:
-            s = {
-                "auth_token": config.twilio_auth_token,
-                "sid": config.twilio_account_sid,
-                "from_num": str(config.twilio_from_num),
-                "sending_cost": float(config.twilio_sending_cost),
-            }
-            cache.set("twilio_settings", s, 3600)
-            return s
-        else:
-            return cached
+        return {
+            "auth_token": config.twilio_auth_token,
+            "sid": config.twilio_account_sid,
+            "from_num": str(config.twilio_from_num),
+            "sending_cost": float(config.twilio_sending_cost),
+        }
 
     class Meta:
         verbose_name = "Site Configuration"
 
 
-class DefaultResponses(SingletonModel):
+class DefaultResponses(CachedSingletonModel):
     """
     Stores the site wide default responses.
 
@@ -13,6 +13,29 @@ class TestKeywords:
     def test_display(self, keywords):
         assert str(keywords["test"]) == "test"
 
+    def test_add_contact_to_groups(self, keywords, recipients, groups, django_assert_max_num_queries):
+        keyword = keywords["test"]
+        keyword.linked_groups.add(groups["test_group"], groups["empty_group"], groups["archived_group"])
+        calvin = recipients["calvin"]
+        # linked groups, existing memberships, one insert (in a savepoint) and
+        # one update marking the groups as changed:
+        with django_assert_max_num_queries(6):
+            keyword.add_contact_to_groups(calvin)
+        assert sorted(g.name for g in calvin.groups.all()) == ["Empty Group", "Test Group"]
+        # already in the groups, so nothing is written:
+        with django_assert_max_num_queries(1):
+            keyword.add_contact_to_groups(calvin.pk)
+        keyword.linked_groups.remove(groups["empty_group"])
+        keyword.add_contact_to_groups(recipients["john_owen"])
+        assert [g.name for g in recipients["john_owen"].groups.all()] == ["Test Group"]
+
+    def test_match_from_memory(self, keywords, django_assert_num_queries):
+        assert Keyword.match("test msg") == keywords["test"]
+        with django_assert_num_queries(0):
+            assert Keyword.match("test msg") == keywords["test"]
+        Keyword.objects.create(keyword="tes", description="tes", custom_response="tes")
+        assert str(Keyword.match("test msg")) == "tes"
+
     def test_disabled_reply(self, keywords, recipients):
         assert keywords["test_do_not_reply"].construct_reply(recipients["calvin"]) == ""
 
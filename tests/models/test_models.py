@@ -38,6 +38,29 @@ class TestSiteConfig:
     def test_display(self):
         assert "Site Configuration" == str(smodels.SiteConfiguration.get_solo())
 
+    def test_held_in_memory(self, django_assert_num_queries):
+        smodels.SiteConfiguration.get_solo()
+        with django_assert_num_queries(0):
+            smodels.SiteConfiguration.get_solo()
+
+    def test_unsaved_changes_not_shared(self):
+        config = smodels.SiteConfiguration.get_solo()
+        config.site_name = "not saved"
+        assert smodels.SiteConfiguration.get_solo().site_name == "apostello"
+
+    def test_model_state_not_shared(self):
+        config = smodels.SiteConfiguration.get_solo()
+        config._state.adding = True
+        assert not smodels.SiteConfiguration.get_solo()._state.adding
+
+    def test_save_seen_by_other_processes(self):
+        config = smodels.SiteConfiguration.get_solo()
+        config.site_name = "changed"
+        config.save()
+        # another process, whose copy has expired:
+        smodels.CachedSingletonModel._memory[smodels.SiteConfiguration] = (0, None, smodels.SiteConfiguration())
+        assert smodels.SiteConfiguration.get_solo().site_name == "changed"
+
 
 @pytest.mark.django_db
 class TestDefaultResponses:
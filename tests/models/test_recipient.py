@@ -2,6 +2,8 @@ import pytest
 from django.utils import timezone
 from tests.conftest import twilio_vcr
 
+from apostello import models
+
 
 @pytest.mark.django_db
 class TestRecipient:
@@ -11,6 +13,11 @@ class TestRecipient:
     def test_personalise(self, recipients):
         assert recipients["calvin"].personalise("Hi %name%!") == "Hi John!"
 
+    def test_personalise_last_name_and_group(self, recipients):
+        msg = "Hi %name% %last_name% (%group%)"
+        assert recipients["calvin"].personalise(msg) == "Hi John Calvin (%group%)"
+        assert recipients["calvin"].personalise(msg, group="Test") == "Hi John Calvin (Test)"
+
     def test_archiving(self, recipients):
         recipients["calvin"].archive()
         assert recipients["calvin"].is_archived
@@ -30,3 +37,31 @@ class TestRecipient:
 
     def test_send_archived(self, recipients):
         recipients["knox"].send_message("test")
+
+    def test_last_sms_empty(self, recipients):
+        assert recipients["calvin"].last_sms == {"content": "", "time_received": ""}
+
+    def test_last_sms_invalidated_on_new_sms(self, recipients, smsin):
+        calvin = recipients["calvin"]
+        assert calvin.last_sms["content"] == "archived message"
+        models.SmsInbound.objects.create(
+            content="newer message",
+            time_received=timezone.now(),
+            sender_name="John Calvin",
+            sender_num=str(calvin.number),
+            matched_keyword="test",
+            sid="new_sms",
+        )
+        assert calvin.last_sms["content"] == "newer message"
+
+    def test_prefetch_last_sms(self, recipients, smsin, django_assert_num_queries):
+        contacts = list(models.Recipient.objects.all())
+        with django_assert_num_queries(1):
+            models.Recipient.prefetch_last_sms(contacts)
+        by_pk = {c.pk: c for c in contacts}
+        assert by_pk[recipients["calvin"].pk].last_sms["content"] == "archived message"
+        assert by_pk[recipients["knox"].pk].last_sms["content"] == ""
+        # now cached:
+        contacts = list(models.Recipient.objects.all())
+        with django_assert_num_queries(0):
+            models.Recipient.prefetch_last_sms(contacts)
@@ -0,0 +1,50 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.serializers import BaseModelSerializer
+
+
+@pytest.mark.django_db
+class TestFieldsPushdown:
+    """Test that only the requested fields are loaded and serialized."""
+
+    def test_only_requested_columns(self, recipients, smsout, users):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = users["c_staff"].get("/api/v2/sms/out/", {"fields": "content,pk"})
+        assert resp.status_code == 200
+        results = resp.json()["results"]
+        assert results and all(set(r) == {"content", "pk"} for r in results)
+        log_query = next(q["sql"] for q in ctx.captured_queries if 'FROM "apostello_smsoutbound"' in q["sql"])
+        assert "sent_by" not in log_query
+        assert "apostello_recipient" not in log_query
+
+    def test_related_loaded_when_requested(self, recipients, smsout, users):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = users["c_staff"].get("/api/v2/sms/out/", {"fields": "pk,recipient"})
+        assert all(set(r) == {"pk", "recipient"} for r in resp.json()["results"])
+        assert not any(q["sql"].startswith('SELECT "apostello_recipient"') for q in ctx.captured_queries)
+
+    def test_sender_pk_not_looked_up(self, smsin, users):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = users["c_staff"].get("/api/v2/sms/in/", {"fields": "pk,content"})
+        assert all(set(r) == {"pk", "content"} for r in resp.json()["results"])
+        assert not any("_sender_pk" in q["sql"] for q in ctx.captured_queries)
+
+
+@pytest.mark.django_db
+class TestValuesSerialization:
+    """Serializing rows from `.values()` gives the same result as serializing model instances."""
+
+    @pytest.mark.parametrize("url", ["/api/v2/sms/in/", "/api/v2/recipients/"])
+    @pytest.mark.parametrize("client", ["c_staff", "c_in"])
+    @pytest.mark.parametrize("params", [{}, {"fields": "pk,full_name,last_sms"}, {"fields!": "content"}])
+    def test_same_as_instances(self, recipients, keywords, smsin, users, monkeypatch, url, client, params):
+        keywords["test"].owners.add(users["notstaff2"])
+        params = dict(params, page_size=100)
+        fast = users[client].get(url, params)
+        assert fast.status_code == 200
+        monkeypatch.setattr(BaseModelSerializer, "value_columns", lambda self: None)
+        slow = users[client].get(url, params)
+        assert fast.json() == slow.json()
+        assert fast.json()["results"]
@@ -0,0 +1,67 @@
+import pytest
+
+from api.views import Collection, etag_matches
+
+
+class TestEtagMatches:
+    @pytest.mark.parametrize(
+        "header,matches",
+        [
+            (None, False),
+            ("", False),
+            ("*", True),
+            ('W/"abc"', True),
+            ('"abc"', True),
+            ('W/"xyz", W/"abc"', True),
+            ('W/"xyz"', False),
+        ],
+    )
+    def test_match(self, header, matches):
+        assert etag_matches('W/"abc"', header) is matches
+
+
+@pytest.mark.django_db
+class TestConditionalGet:
+    """Test ETags on collection endpoints."""
+
+    url = "/api/v2/recipients/"
+
+    def test_not_modified(self, recipients, users, monkeypatch):
+        resp = users["c_staff"].get(self.url)
+        assert resp.status_code == 200
+        etag = resp["ETag"]
+        assert etag.startswith('W/"')
+
+        def no_query(*args, **kwargs):
+            raise AssertionError("collection should not be queried")
+
+        monkeypatch.setattr(Collection, "get_queryset", no_query)
+        resp = users["c_staff"].get(self.url, HTTP_IF_NONE_MATCH=etag)
+        assert resp.status_code == 304
+        assert resp["ETag"] == etag
+        assert resp.content == b""
+
+    def test_changed(self, recipients, users):
+        etag = users["c_staff"].get(self.url)["ETag"]
+        recipients["calvin"].first_name = "Jean"
+        recipients["calvin"].save()
+        resp = users["c_staff"].get(self.url, HTTP_IF_NONE_MATCH=etag)
+        assert resp.status_code == 200
+        assert resp["ETag"] != etag
+
+    def test_incoming_sender_deleted(self, recipients, smsin, users):
+        etag = users["c_staff"].get("/api/v2/sms/in/")["ETag"]
+        recipients["calvin"].delete()
+        resp = users["c_staff"].get("/api/v2/sms/in/", HTTP_IF_NONE_MATCH=etag)
+        assert resp.status_code == 200
+        assert resp["ETag"] != etag
+
+    def test_depends_on_user_and_params(self, recipients, users):
+        etag = users["c_staff"].get(self.url)["ETag"]
+        assert users["c_in"].get(self.url)["ETag"] != etag
+        assert users["c_staff"].get(self.url, {"page": 1})["ETag"] != etag
+
+    def test_no_etag(self, users):
+        resp = users["c_staff"].get("/api/v2/queued/sms/")
+        assert resp.status_code == 200
+        assert not resp.has_header("ETag")
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+import pytest
+from django.core.cache import cache
+from django.utils import timezone
+
+from apostello.models import Recipient, SmsInbound
+from graphs import graph_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_graph_cache():
+    cache.delete_many([graph_cache.graph_key(name, **kwargs) for name, kwargs in graph_cache.PRERENDERED_GRAPHS])
+
+
+@pytest.mark.django_db
+class TestGraphCache:
+    def test_cached_until_data_changes(self, recipients):
+        first = graph_cache.get_graph("contacts")
+        assert graph_cache.get_graph("contacts")["etag"] == first["etag"]
+        Recipient.objects.create(first_name="New", last_name="Person", number="+447900000999")
+        assert graph_cache.get_graph("contacts")["etag"] != first["etag"]
+
+    def test_unrelated_changes_keep_graph(self, recipients, smsin):
+        first = graph_cache.get_graph("contacts")
+        SmsInbound.objects.create(sender_num="+447900000999", content="test", time_received=timezone.now())
+        assert graph_cache.get_graph("contacts")["etag"] == first["etag"]
+
+    def test_rerendered_next_day(self, smsin, smsout, monkeypatch):
+        first = graph_cache.get_graph("recent", days=7)
+        assert graph_cache.get_graph("recent", days=7)["etag"] == first["etag"]
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        monkeypatch.setattr(graph_cache.timezone, "localdate", lambda: tomorrow)
+        second = graph_cache.get_graph("recent", days=7)
+        assert second["version"] == first["version"]
+        assert second["date"] == tomorrow
+        assert second["etag"] != first["etag"]
+
+    def test_background_render(self, smsin, smsout):
+        # conftest runs queued tasks synchronously, so the render is available straight away:
+        assert graph_cache.get_graph("recent", inline=False, days=7) is not None
+
+    def test_render_graphs(self, smsin, smsout):
+        from apostello.tasks import render_graphs
+
+        render_graphs()
+        for name, kwargs in graph_cache.PRERENDERED_GRAPHS:
+            assert cache.get(graph_cache.graph_key(name, **kwargs)) is not None
+
+
+@pytest.mark.slow
+@pytest.mark.django_db
+class TestGraphView:
+    def test_etag(self, users, recipients):
+        r = users["c_staff"].get("/graphs/contacts/")
+        assert r.status_code == 200
+        assert r["ETag"]
+        assert "no-cache" in r["Cache-Control"]
+        r = users["c_staff"].get("/graphs/contacts/", HTTP_IF_NONE_MATCH=r["ETag"])
+        assert r.status_code == 304
+
+    def test_etag_changes_with_data(self, users, recipients):
+        etag = users["c_staff"].get("/graphs/contacts/")["ETag"]
+        Recipient.objects.create(first_name="New", last_name="Person", number="+447900000999")
+        r = users["c_staff"].get("/graphs/contacts/", HTTP_IF_NONE_MATCH=etag)
+        assert r.status_code == 200
+        assert r["ETag"] != etag
+
+    def test_recent_default_window(self, users, smsin, smsout):
+        from apostello.tasks import render_graphs
+
+        render_graphs()
+        default = users["c_staff"].get("/graphs/recent/")
+        assert default.status_code == 200
+        assert default["ETag"] == users["c_staff"].get("/graphs/recent/30/")["ETag"]
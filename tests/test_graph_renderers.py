@@ -0,0 +1,36 @@
+import pytest
+
+from apostello.models import Recipient, SmsInbound
+from graphs import renderers
+
+
+@pytest.mark.django_db
+class TestRenderers:
+    @pytest.mark.parametrize(
+        "renderer",
+        [
+            renderers.contacts,
+            renderers.groups,
+            renderers.keywords,
+            renderers.incoming_by_contact,
+            renderers.outgoing_by_contact,
+            renderers.sms_totals,
+        ],
+    )
+    def test_render(self, renderer, groups, keywords, smsin, smsout):
+        assert renderer().startswith(b"<?xml")
+
+    @pytest.mark.parametrize("renderer", [renderers.incoming_by_contact, renderers.outgoing_by_contact])
+    def test_by_contact_queries_do_not_scale_with_contacts(
+        self, renderer, smsin, smsout, django_assert_max_num_queries
+    ):
+        for i in range(20):
+            Recipient.objects.create(first_name="Test", last_name=str(i), number="+44790000{0:04d}".format(i))
+        # last rolled up day, rolled up counts, counts since, contact names:
+        with django_assert_max_num_queries(4):
+            renderer()
+
+    def test_top_n(self):
+        counts = [("a", 1), ("b", 5), ("c", 3), ("d", 2)]
+        assert renderers._top_n(counts, n=2) == [("b", 5), ("c", 3), ("Others", 3)]
+        assert renderers._top_n(counts, n=4) == [("b", 5), ("c", 3), ("d", 2), ("a", 1)]
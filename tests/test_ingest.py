@@ -0,0 +1,70 @@
+import pytest
+from tests.conftest import twilio_vcr
+from django.core.cache import cache
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from apostello import ingest
+from apostello.models import Recipient, SmsInbound
+from apostello.tasks import process_inbound
+
+
+@pytest.fixture
+def empty_buffer():
+    get_redis_connection("default").delete(ingest.BUFFER_KEY)
+    # stop the buffer being drained as soon as a message is added:
+    cache.set("inbound_sms_drain_queued", True, 60)
+    yield
+    get_redis_connection("default").delete(ingest.BUFFER_KEY)
+    cache.delete("inbound_sms_drain_queued")
+
+
+def buffered(sid, **kwargs):
+    fields = {
+        "sid": sid,
+        "content": "buffered",
+        "time_received": timezone.now(),
+        "sender_name": "John Calvin",
+        "sender_num": "+447927401749",
+        "matched_keyword": "No Match",
+        "matched_colour": "#B6B6B6",
+    }
+    fields.update(kwargs)
+    ingest.buffer_sms(**fields)
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("empty_buffer")
+class TestIngest:
+    """Test buffered logging of incoming messages."""
+
+    def test_drain(self, recipients, monkeypatch, django_assert_max_num_queries):
+        queued = []
+        monkeypatch.setattr("apostello.ingest.async_task", lambda func: queued.append(func))
+        SmsInbound.objects.create(sid="imported", content="imported", time_received=timezone.now())
+        for sid in ["a", "b", "a", "imported", "c"]:
+            buffered(sid, content="msg {0}".format(sid))
+        assert ingest.buffered_count() == 5
+        # one read and one write per batch:
+        with django_assert_max_num_queries(3 * 2):
+            assert ingest.drain_buffer(batch_size=3) == 3
+        assert ingest.buffered_count() == 0
+        # caches are refreshed once per batch:
+        assert queued == ["apostello.tasks.populate_keyword_response_count"] * 2 + [
+            "apostello.tasks.check_incoming_log"
+        ]
+        assert sorted(SmsInbound.objects.values_list("sid", flat=True)) == ["a", "b", "c", "imported"]
+        assert SmsInbound.objects.get(sid="imported").content == "imported"
+        assert Recipient.fetch_last_sms([recipients["calvin"]])[recipients["calvin"].pk]["content"] == "msg c"
+
+    @twilio_vcr
+    def test_process_inbound_buffers(self, recipients, settings):
+        settings.SMS_BUFFERED_INGEST = True
+        calvin = recipients["calvin"]
+        p = {"Body": "New test message", "MessageSid": "buffereduuid", "From": str(calvin.number)}
+        contact = {"pk": calvin.pk, "name": str(calvin), "number": str(calvin.number), "is_blocking": False}
+        process_inbound(p, timezone.now(), contact, "No Match", False)
+        assert not SmsInbound.objects.filter(sid="buffereduuid").exists()
+        assert ingest.buffered_count() == 1
+        ingest.drain_buffer()
+        assert SmsInbound.objects.get(sid="buffereduuid").sender_name == "John Calvin"
@@ -143,6 +143,41 @@ class TestExpiry:
         logs.cleanup_expired_sms()
         assert models.SmsInbound.objects.count() == 0  # cleanup should remove sms
 
+    def _old_sms(self, n):
+        config = SiteConfiguration.get_solo()
+        config.sms_rolling_expiration_days = 10
+        config.save()
+        for i in range(n):
+            models.SmsInbound.objects.create(
+                content="test message",
+                time_received=timezone.now() - timedelta(days=20),
+                sender_name="John Calvin",
+                sender_num="+447927401749",
+                matched_keyword="test",
+                sid="old_{0}".format(i),
+            )
+        models.SmsInbound.objects.create(
+            content="new message", time_received=timezone.now(), sender_num="+447927401749", sid="new"
+        )
+
+    def test_cleanup_in_chunks(self, monkeypatch):
+        self._old_sms(5)
+        old_pks = set(models.SmsInbound.objects.exclude(sid="new").values_list("pk", flat=True))
+        monkeypatch.setattr(logs, "CLEANUP_CHUNK_SIZE", 2)
+        monkeypatch.setattr(logs, "CLEANUP_MAX_CHUNK_SIZE", 2)
+        logs.cleanup_expired_sms()
+        assert list(models.SmsInbound.objects.values_list("sid", flat=True)) == ["new"]
+        assert set(models.Tombstone.deleted_since(models.SmsInbound, timezone.now() - timedelta(1))) == old_pks
+
+    def test_cleanup_out_of_time(self, monkeypatch):
+        self._old_sms(5)
+        queued = []
+        monkeypatch.setattr(logs, "CLEANUP_TIME_BUDGET", 0)
+        monkeypatch.setattr(logs, "async_task", lambda *args: queued.append(args))
+        logs.cleanup_expired_sms()
+        assert queued == [("apostello.tasks.cleanup_expired_sms",)]
+        assert models.SmsInbound.objects.count() == 6
+
 
 @pytest.mark.django_db
 class TestSmsHandlers:
@@ -175,6 +210,25 @@ class TestSmsHandlers:
 
 @pytest.mark.django_db
 class TestFetchingClients:
+    def test_cutoff_sent_to_twilio(self, monkeypatch):
+        config = SiteConfiguration.get_solo()
+        config.sms_expiration_date = None
+        config.sms_rolling_expiration_days = 10
+        config.save()
+        old_msg, new_msg = MockMsg("447922537999"), MockMsg("447922537999")
+        old_msg.sid, old_msg.date_created = "b" * 34, timezone.now() - timedelta(days=20)
+        calls = []
+
+        def fake_list(**kwargs):
+            calls.append(kwargs)
+            return [old_msg, new_msg]
+
+        client = types.SimpleNamespace(messages=types.SimpleNamespace(list=fake_list))
+        monkeypatch.setattr(logs, "get_twilio_client", lambda: client)
+        logs.check_incoming_log()
+        assert calls[0]["date_sent_after"] == logs.expiry_cutoff()
+        assert list(models.SmsInbound.objects.values_list("sid", flat=True)) == [new_msg.sid]
+
     @twilio_vcr
     def test_fetch_all_in(self):
         i = logs.fetch_generator("in")
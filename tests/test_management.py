@@ -26,9 +26,9 @@ class TestManagementCommands:
     def test_setup_scheduled_tasks(self):
         """Test setup of perdiodic tasks and ensure function is idempotent."""
         call_command("setup_periodic_tasks")
-        assert Schedule.objects.all().count() == 6
+        assert Schedule.objects.all().count() == 11
         call_command("setup_periodic_tasks")
-        assert Schedule.objects.all().count() == 6
+        assert Schedule.objects.all().count() == 11
 
     def test_write_elm_urls(self):
         """Test Elm Urls are up to date."""
@@ -0,0 +1,29 @@
+import pytest
+from django.core.cache import cache
+from django.utils import timezone
+
+from apostello import metrics
+
+
+@pytest.fixture
+def clear_histogram():
+    cache.delete_many([metrics.bucket_key("test", timezone.localdate(), b) for b in metrics.BUCKETS])
+
+
+@pytest.mark.usefixtures("clear_histogram")
+class TestMetrics:
+    """Test the latency histograms."""
+
+    def test_empty(self):
+        summary = metrics.summary("test")
+        assert summary["count"] == 0
+        assert summary["p99"] is None
+
+    def test_observe(self):
+        for seconds in [0.0005] * 90 + [0.008] * 9 + [20]:
+            metrics.observe("test", seconds)
+        summary = metrics.summary("test")
+        assert summary["count"] == 100
+        assert summary["buckets"][0] == {"le": 1, "count": 90}
+        assert summary["buckets"][-1] == {"le": "inf", "count": 1}
+        assert (summary["p50"], summary["p90"], summary["p99"]) == (1, 1, 10)
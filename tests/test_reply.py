@@ -1,3 +1,5 @@
+import uuid
+
 import pytest
 from tests.conftest import twilio_vcr
 
@@ -110,3 +112,37 @@ class TestConstructReply:
         reply = msg.construct_reply()
         grp = RecipientGroup.objects.get(name="Empty Group")
         assert grp.recipient_set.count() == 1
+
+
+@pytest.mark.django_db
+def test_start_bg_tasks_queues_one_task(recipients, monkeypatch):
+    queued = []
+    monkeypatch.setattr("apostello.reply.async_task", lambda *args, **kwargs: queued.append(args))
+    msg = InboundSms({"From": str(recipients["wesley"].number), "Body": "test", "MessageSid": "abc"})
+    msg.start_bg_tasks()
+    assert len(queued) == 1
+    func, params, received, contact, keyword, send_name_sms = queued[0]
+    assert func == "apostello.tasks.process_inbound"
+    assert contact == {
+        "pk": recipients["wesley"].pk,
+        "name": "John Wesley",
+        "number": str(recipients["wesley"].number),
+        "is_blocking": True,
+    }
+    assert keyword == "No Match"
+
+
+def test_pending_claim_expires_quickly():
+    from django.core.cache import cache
+
+    from apostello import reply
+
+    sid = "SM{0}".format(uuid.uuid4().hex)
+    key = reply.seen_sms_key(sid)
+    assert reply.claim_sms(sid)
+    assert not reply.claim_sms(sid)
+    # a worker that dies while handling the message must not block Twilio's retry for long:
+    assert 0 < cache.ttl(key) <= reply.PENDING_SMS_TIMEOUT
+    reply.remember_reply(sid, "thanks")
+    assert cache.ttl(key) > reply.PENDING_SMS_TIMEOUT
+    assert reply.previous_reply(sid) == "thanks"
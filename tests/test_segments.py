@@ -0,0 +1,30 @@
+import pytest
+
+from apostello.segments import GSM, UCS2, measure, segment_count
+
+
+class TestSegments:
+    @pytest.mark.parametrize(
+        "text,encoding,characters,segments",
+        [
+            ("", GSM, 0, 1),
+            ("a" * 160, GSM, 160, 1),
+            ("a" * 161, GSM, 161, 2),
+            ("a" * 306, GSM, 306, 2),
+            ("a" * 307, GSM, 307, 3),
+            ("€" * 80, GSM, 160, 1),
+            ("€" * 81, GSM, 162, 2),
+            ("{hello}", GSM, 9, 1),
+            ("Привет", UCS2, 6, 1),
+            ("a" * 69 + "ж", UCS2, 70, 1),
+            ("a" * 70 + "ж", UCS2, 71, 2),
+            ("ж" * 134, UCS2, 134, 2),
+            ("ж" * 135, UCS2, 135, 3),
+            ("🙂", UCS2, 2, 1),
+        ],
+    )
+    def test_measure(self, text, encoding, characters, segments):
+        assert measure(text) == (encoding, characters, segments)
+
+    def test_segment_count(self):
+        assert segment_count("a" * 200) == 2
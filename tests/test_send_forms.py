@@ -3,7 +3,7 @@ from datetime import datetime, timedelta
 import pytest
 from tests.conftest import twilio_vcr
 
-from apostello import models, tasks
+from apostello import audience, models, tasks
 
 
 @pytest.mark.slow
@@ -127,3 +127,119 @@ class TestGroupForm:
         assert resp.status_code == 201
         g = models.RecipientGroup.objects.get(name="Empty Group")
         assert len(g.all_recipients) == 7
+
+
+@pytest.mark.slow
+@pytest.mark.django_db
+class TestSmsCostEstimate:
+    """Test estimating the cost of a message."""
+
+    def test_adhoc(self, recipients, users):
+        resp = users["c_staff"].post(
+            "/api/v2/actions/sms/cost/",
+            {"content": "Hi %name% {0}".format("€" * 80), "recipients": [str(recipients["calvin"].pk)]},
+        )
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["encoding"] == "gsm"
+        assert data["segments"] == 2
+        assert data["recipients"] == 1
+        assert data["sms"] == 2
+        assert data["cost"] == pytest.approx(0.08)
+
+    def test_group(self, groups, users):
+        resp = users["c_staff"].post(
+            "/api/v2/actions/sms/cost/", {"content": "Привет", "recipient_group": str(groups["test_group"].pk)}
+        )
+        data = resp.json()
+        assert data["encoding"] == "ucs2"
+        assert data["recipients"] == 2
+        assert data["sms"] == 2
+
+    def test_no_recipients(self, users):
+        resp = users["c_staff"].post("/api/v2/actions/sms/cost/", {"content": "test"})
+        assert resp.status_code == 400
+
+    def test_not_allowed(self, recipients, users):
+        resp = users["c_in"].post("/api/v2/actions/sms/cost/", {"content": "test", "recipients": "1"})
+        assert resp.status_code >= 400
+
+
+@pytest.mark.slow
+@pytest.mark.django_db
+class TestSendPreview:
+    """Test the send dry run."""
+
+    def test_group(self, recipients, groups, users):
+        groups["test_group"].recipient_set.add(recipients["wesley"], recipients["knox"])
+        num_sms = models.SmsOutbound.objects.count()
+        resp = users["c_staff"].post(
+            "/api/v2/actions/sms/send/preview/",
+            {"content": "Hi %name%, from %group%", "recipient_group": str(groups["test_group"].pk)},
+        )
+        assert resp.status_code == 200
+        data = resp.json()
+        assert sorted(r["content"] for r in data["recipients"]) == [
+            "Hi Johannes, from Test Group",
+            "Hi John, from Test Group",
+        ]
+        assert data["skipped"] == {"archived": 1, "blocking": 1, "never_contact": 0}
+        assert data["sms"] == 2
+        assert data["cost"] == pytest.approx(0.08)
+        assert data["estimated_duration"] == 2
+        # nothing is sent:
+        assert models.SmsOutbound.objects.count() == num_sms
+
+    def test_hides_names(self, recipients, users):
+        models.UserProfile.objects.filter(user=users["staff"]).update(can_see_contact_names=False)
+        resp = users["c_staff"].post(
+            "/api/v2/actions/sms/send/preview/", {"content": "Hi %name%", "recipients": [str(recipients["calvin"].pk)]}
+        )
+        assert resp.json()["recipients"] == [
+            {"pk": recipients["calvin"].pk, "encoding": "gsm", "segments": 1, "cost": pytest.approx(0.04)}
+        ]
+
+
+@pytest.mark.slow
+@pytest.mark.django_db
+class TestSendTarget:
+    """Test sending to a combination of groups."""
+
+    def test_target(self, recipients, groups):
+        other = models.RecipientGroup.objects.create(name="Other Group", description="other")
+        other.recipient_set.add(recipients["calvin"], recipients["john_owen"], recipients["beza"])
+        test_group = groups["test_group"].pk
+
+        def names(**kwargs):
+            return sorted(r.last_name for r in audience.target(**kwargs))
+
+        assert names(groups=[test_group, other.pk]) == ["Beza", "Calvin", "Oecolampadius", "Owen"]
+        assert names(groups=[test_group], require=[other.pk]) == ["Calvin"]
+        assert names(groups=[test_group], exclude=[other.pk]) == ["Oecolampadius"]
+        assert names(groups=[other.pk], exclude_do_not_reply=True) == ["Calvin", "Owen"]
+        assert names(groups=[groups["archived_group"].pk]) == []
+
+    def test_send(self, recipients, groups, users):
+        other = models.RecipientGroup.objects.create(name="Other Group", description="other")
+        other.recipient_set.add(recipients["calvin"], recipients["wesley"])
+        groups["test_group"].recipient_set.add(recipients["wesley"])
+        resp = users["c_staff"].post(
+            "/api/v2/actions/sms/send/target/",
+            {
+                "content": "test",
+                "groups": [str(groups["test_group"].pk), str(other.pk)],
+                "exclude_groups": [str(groups["empty_group"].pk)],
+                "scheduled_time": "2117-12-01 00:00",
+            },
+        )
+        assert resp.status_code == 201
+        assert "1 blocking" in resp.json()["messages"][0]["text"]
+        # calvin is in both groups, but only gets one message:
+        assert sorted(q.recipient.last_name for q in models.QueuedSms.objects.all()) == ["Calvin", "Oecolampadius"]
+
+    def test_cost_limit(self, recipients, groups, users):
+        models.UserProfile.objects.filter(user=users["staff"]).update(message_cost_limit=0.01)
+        resp = users["c_staff"].post(
+            "/api/v2/actions/sms/send/target/", {"content": "test", "groups": [str(groups["test_group"].pk)]}
+        )
+        assert resp.status_code == 400
@@ -1,6 +1,10 @@
+from datetime import timedelta
+
 import pytest
+from django.utils import timezone
 
-from graphs.sms_freq import sms_graph_data
+from apostello.models import SmsInbound
+from graphs.sms_freq import GRAPH_WINDOWS, graph_dates, sms_graph_data, sms_graph_series
 
 
 @pytest.mark.django_db
@@ -12,3 +16,28 @@ class TestSmsFreq:
     def test_sms_freq_out(self, smsout):
         graph_data = sms_graph_data(direction="out")
         assert 1 in graph_data
+
+    @pytest.mark.parametrize("days", GRAPH_WINDOWS)
+    def test_windows(self, days, smsin, smsout):
+        data = sms_graph_series(days=days)
+        assert len(data["in"]) == len(data["out"]) == len(graph_dates(days)) == days + 1
+        assert data["in"][-1] == 3
+        assert data["out"][-1] == 1
+
+    def test_local_day_buckets(self, smsin):
+        SmsInbound.objects.create(
+            content="old message",
+            time_received=timezone.now() - timedelta(days=3),
+            sender_name="John Calvin",
+            sender_num="+447927401749",
+            matched_keyword="test",
+            sid="old_msg",
+        )
+        data = sms_graph_series(days=7)
+        assert data["in"][-1] == 3
+        assert data["in"][-4] == 1
+        assert sum(data["in"]) == 4
+
+    def test_bad_window(self):
+        with pytest.raises(ValueError):
+            sms_graph_series(days=12)
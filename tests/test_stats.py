@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from apostello import stats
+from apostello.models import DailySmsStats, SmsInbound
+from graphs.sms_freq import graph_dates
+
+
+@pytest.fixture
+def old_sms(smsin, smsout):
+    for days in (2, 5):
+        SmsInbound.objects.create(
+            content="old message",
+            time_received=timezone.now() - timedelta(days=days),
+            sender_name="John Calvin",
+            sender_num="+447927401749",
+            matched_keyword="test",
+            sid="old_msg_{0}".format(days),
+        )
+
+
+@pytest.mark.django_db
+class TestDailyStats:
+    def test_nothing_to_roll_up(self):
+        assert stats.update_daily_stats() == 0
+        assert stats.last_rolled_up_day() is None
+
+    def test_roll_up(self, old_sms):
+        stats.update_daily_stats()
+        yesterday = timezone.localdate() - timedelta(days=1)
+        assert stats.last_rolled_up_day() == yesterday
+        # one dense total row per direction per day, oldest message was 5 days ago:
+        assert DailySmsStats.objects.filter(dimension=DailySmsStats.TOTAL).count() == 2 * 5
+        rolled_up = DailySmsStats.objects.filter(direction=DailySmsStats.IN, dimension=DailySmsStats.KEYWORD)
+        assert sum(rolled_up.values_list("count", flat=True)) == 2
+        # today is never rolled up:
+        assert not DailySmsStats.objects.filter(day=timezone.localdate()).exists()
+
+    def test_roll_up_is_repeatable(self, old_sms):
+        stats.update_daily_stats()
+        rows = set(DailySmsStats.objects.values_list("day", "direction", "dimension", "value", "count"))
+        stats.update_daily_stats()
+        stats.update_daily_stats(start=stats.last_rolled_up_day() - timedelta(days=4))
+        assert set(DailySmsStats.objects.values_list("day", "direction", "dimension", "value", "count")) == rows
+
+    def test_reports_match_logs(self, old_sms):
+        dates = graph_dates(7)
+        live = (
+            stats.daily_counts(DailySmsStats.IN, dates),
+            stats.totals(DailySmsStats.IN, DailySmsStats.CONTACT),
+            stats.total(DailySmsStats.IN),
+            stats.total(DailySmsStats.OUT),
+        )
+        stats.update_daily_stats()
+        assert (
+            stats.daily_counts(DailySmsStats.IN, dates),
+            stats.totals(DailySmsStats.IN, DailySmsStats.CONTACT),
+            stats.total(DailySmsStats.IN),
+            stats.total(DailySmsStats.OUT),
+        ) == live
+        assert live[2] == SmsInbound.objects.count()
+
+    def test_totals_limited_to_values(self, old_sms):
+        stats.update_daily_stats()
+        counts = stats.totals(DailySmsStats.IN, DailySmsStats.KEYWORD, values=["test"])
+        assert list(counts) == ["test"]
+        assert counts["test"] == SmsInbound.objects.filter(matched_keyword="test").count()
@@ -0,0 +1,144 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from apostello import sync
+from apostello.models import Keyword, Recipient, RecipientGroup, SmsInbound, SmsOutbound, Tombstone
+
+
+def age_everything():
+    """Make every row look like it was last changed a while ago."""
+    then = timezone.now() - timedelta(minutes=10)
+    for model in sync.SYNCED_MODELS:
+        model.objects.update(updated_at=then)
+    return timezone.now()
+
+
+@pytest.mark.django_db
+class TestChanged:
+    """Test finding objects changed since a cursor."""
+
+    def test_updated(self, recipients):
+        since = age_everything()
+        assert not sync.changed(Recipient.objects.all(), since).exists()
+        recipients["calvin"].first_name = "Jean"
+        recipients["calvin"].save()
+        assert list(sync.changed(Recipient.objects.all(), since)) == [recipients["calvin"]]
+
+    def test_recipient_last_sms(self, recipients, smsin):
+        since = age_everything()
+        smsin["sms1"].display_on_wall = True
+        smsin["sms1"].save()
+        assert list(sync.changed(Recipient.objects.all(), since)) == [recipients["calvin"]]
+
+    def test_group_membership(self, recipients, groups):
+        since = age_everything()
+        recipients["john_owen"].groups.add(groups["empty_group"])
+        assert list(sync.changed(RecipientGroup.objects.all(), since)) == [groups["empty_group"]]
+
+    def test_group_membership_cleared(self, recipients, groups):
+        since = age_everything()
+        groups["test_group"].recipient_set.clear()
+        assert list(sync.changed(RecipientGroup.objects.all(), since)) == [groups["test_group"]]
+
+    def test_keyword_adds_contact_to_group(self, recipients, groups, keywords):
+        keywords["test"].linked_groups.add(groups["empty_group"])
+        since = age_everything()
+        keywords["test"].add_contact_to_groups(recipients["calvin"])
+        assert groups["empty_group"].recipient_set.filter(pk=recipients["calvin"].pk).exists()
+        assert list(sync.changed(RecipientGroup.objects.all(), since)) == [groups["empty_group"]]
+
+    def test_groups_after_new_contact(self, recipients, groups):
+        since = age_everything()
+        Recipient.objects.create(first_name="Martin", last_name="Bucer", number="+447900000123")
+        assert sync.changed(RecipientGroup.objects.all(), since).count() == RecipientGroup.objects.count()
+
+    def test_keyword_matches(self, keywords, smsin):
+        since = age_everything()
+        smsin["sms1"].is_archived = True
+        smsin["sms1"].save()
+        assert list(sync.changed(Keyword.objects.all(), since)) == [keywords["test"]]
+
+    def test_keyword_linked_group_deleted(self, keywords, groups):
+        keywords["test"].linked_groups.add(groups["test_group"])
+        since = age_everything()
+        groups["test_group"].delete()
+        assert list(sync.changed(Keyword.objects.all(), since)) == [keywords["test"]]
+
+    def test_outgoing_recipient(self, recipients, smsout):
+        since = age_everything()
+        recipients["calvin"].last_name = "Cauvin"
+        recipients["calvin"].save()
+        changed = sync.changed(SmsOutbound.objects.all(), since)
+        assert changed.count() == SmsOutbound.objects.filter(recipient=recipients["calvin"]).count() > 0
+
+    def test_incoming_sender(self, recipients, smsin, monkeypatch):
+        # before the sender's new name has been copied to their messages in the background:
+        monkeypatch.setattr("apostello.tasks.update_msgs_name", lambda person_pk: None)
+        since = age_everything()
+        recipients["house_lamp"].first_name = "Johann"
+        recipients["house_lamp"].save()
+        assert not sync.changed(SmsInbound.objects.all(), since).exists()
+        recipients["calvin"].first_name = "Jean"
+        recipients["calvin"].save()
+        assert sync.changed(SmsInbound.objects.all(), since).count() == SmsInbound.objects.count()
+
+    def test_incoming_sender_deleted(self, recipients, smsin):
+        since = age_everything()
+        recipients["calvin"].delete()
+        assert sync.changed(SmsInbound.objects.all(), since).count() == SmsInbound.objects.count()
+
+
+@pytest.mark.django_db
+class TestTombstones:
+    def test_delete(self, recipients):
+        since = timezone.now()
+        pk = recipients["calvin"].pk
+        recipients["calvin"].delete()
+        assert sync.deleted(Recipient, since) == [pk]
+        assert sync.deleted(Keyword, since) == []
+
+    def test_purge(self, recipients):
+        recipients["calvin"].delete()
+        Tombstone.objects.update(deleted_at=timezone.now() - timedelta(days=sync.TOMBSTONE_DAYS + 1))
+        recipients["house_lamp"].delete()
+        sync.purge_tombstones()
+        assert Tombstone.objects.count() == 1
+
+
+@pytest.mark.django_db
+class TestSyncApi:
+    """Test collection endpoints with a `since` cursor."""
+
+    def test_changes(self, recipients, users, settings):
+        settings.CURSOR_OVERLAP = timedelta(0)
+        since = age_everything()
+        recipients["calvin"].first_name = "Jean"
+        recipients["calvin"].save()
+        pk = recipients["wesley"].pk
+        recipients["wesley"].delete()
+        resp = users["c_staff"].get("/api/v2/recipients/", {"since": since.isoformat()})
+        assert resp.status_code == 200
+        data = resp.json()
+        assert [r["first_name"] for r in data["changed"]] == ["Jean"]
+        assert data["deleted"] == [pk]
+
+        data = users["c_staff"].get("/api/v2/recipients/", {"since": data["since"]}).json()
+        assert data["deleted"] == []
+
+    def test_archived_is_deleted_for_non_staff(self, recipients, keywords, users):
+        since = age_everything()
+        keywords["test"].archive()
+        data = users["c_in"].get("/api/v2/keywords/", {"since": since.isoformat()}).json()
+        assert keywords["test"].pk in data["deleted"]
+        assert keywords["test"].pk not in [k["pk"] for k in data["changed"]]
+
+    def test_no_cursor(self, recipients, users):
+        data = users["c_staff"].get("/api/v2/recipients/", {"since": ""}).json()
+        assert "results" in data
+
+    @pytest.mark.parametrize("cursor", ["yesterday", "2018-13-01T00:00:00+00:00", "2001-01-01T00:00:00+00:00"])
+    def test_bad_cursor(self, users, cursor):
+        resp = users["c_staff"].get("/api/v2/sms/in/", {"since": cursor})
+        assert resp.status_code == 400
@@ -38,6 +38,98 @@ class TestTasks:
         # test sending via group
         group_send_message_task("This is another test", "Test group", "test", eta=None)
 
+    def test_send_group_skips_suppressed(self, recipients, groups):
+        groups["test_group"].recipient_set.add(recipients["wesley"], recipients["knox"])
+        skipped = group_send_message_task("test", "Test Group", "test", eta=timezone.now() + timedelta(days=1))
+        assert skipped == {"archived": 1, "blocking": 1, "never_contact": 0}
+        assert sorted(q.recipient.last_name for q in QueuedSms.objects.all()) == ["Calvin", "Oecolampadius"]
+
+    def test_scheduled_group_send_bulk(self, recipients, groups, django_assert_max_num_queries):
+        for i in range(20):
+            groups["test_group"].recipient_set.add(
+                Recipient.objects.create(first_name="Test", last_name=str(i), number="+4479274018{:02d}".format(i))
+            )
+        with django_assert_max_num_queries(5):
+            group_send_message_task("test", "Test Group", "test", eta=timezone.now() + timedelta(days=1))
+        assert QueuedSms.objects.filter(recipient_group=groups["test_group"]).count() == 22
+
+    def test_send_queued_sms_batches(self, recipients, monkeypatch):
+        batches = []
+        monkeypatch.setattr("apostello.tasks.QUEUED_SMS_BATCH_SIZE", 2)
+        monkeypatch.setattr("apostello.tasks.send_queued_batch", lambda pks, claimed_at: batches.append(pks))
+        due = timezone.now() - timedelta(minutes=1)
+        QueuedSms.schedule(Recipient.objects.filter(is_archived=False), "test", "test", due)
+        QueuedSms.objects.create(
+            time_to_send=timezone.now() + timedelta(days=1),
+            content="later",
+            sent_by="test",
+            recipient=recipients["calvin"],
+        )
+        num_due = QueuedSms.objects.filter(content="test").count()
+        send_queued_sms()
+        assert [len(b) for b in batches] == [2] * (num_due // 2) + [num_due % 2] * (num_due % 2)
+        # claimed messages are not picked up again, nor marked as sent until they are sent:
+        assert QueuedSms.objects.filter(claimed_at__isnull=True).count() == 1
+        assert not QueuedSms.objects.filter(sent=True).exists()
+        send_queued_sms()
+        assert len(batches) == -(-num_due // 2)
+
+    def test_send_queued_sms_lost_batch(self, recipients, monkeypatch):
+        batches = []
+        monkeypatch.setattr("apostello.tasks.send_queued_batch", lambda *args: batches.append(args))
+        sms = QueuedSms.objects.create(
+            time_to_send=timezone.now(), content="test", sent_by="test", recipient=recipients["calvin"]
+        )
+        send_queued_sms()
+        first_claim = batches[0][1]
+        # the batch task is lost, so the message is claimed again once the claim times out:
+        QueuedSms.objects.filter(pk=sms.pk).update(claimed_at=timezone.now() - QUEUED_SMS_CLAIM_TIMEOUT)
+        send_queued_sms()
+        assert len(batches) == 2
+        monkeypatch.undo()
+        monkeypatch.setattr("apostello.tasks.recipient_send_message_task", lambda *args: None)
+        # the lost task turning up late does not send it twice:
+        send_queued_batch([sms.pk], first_claim)
+        sms.refresh_from_db()
+        assert not sms.sent
+        send_queued_batch(*batches[1])
+        sms.refresh_from_db()
+        assert sms.sent
+
+    def test_send_queued_batch_failure(self, recipients, monkeypatch):
+        def fail(*args):
+            raise Exception("Twilio is down")
+
+        monkeypatch.setattr("apostello.tasks.recipient_send_message_task", fail)
+        sms = QueuedSms.objects.create(
+            time_to_send=timezone.now(), content="test", sent_by="test", recipient=recipients["calvin"]
+        )
+        send_queued_batch([sms.pk])
+        sms.refresh_from_db()
+        assert sms.failed
+        assert not sms.sent
+
+    def test_archive_queued_sms(self, recipients):
+        old = timezone.now() - timedelta(days=2)
+        for kwargs in [{"sent": True}, {"failed": True}, {}]:
+            QueuedSms.objects.create(
+                time_to_send=old, content="old", sent_by="test", recipient=recipients["calvin"], **kwargs
+            )
+        QueuedSms.objects.create(time_to_send=timezone.now(), content="new", sent_by="test", sent=True)
+        assert archive_queued_sms() == 2
+        assert sorted((q.content, q.sent) for q in QueuedSms.objects.all()) == [("new", True), ("old", False)]
+        history = QueuedSmsHistory.objects.all()
+        assert sorted((h.sent, h.failed) for h in history) == [(False, True), (True, False)]
+        assert all(h.recipient == recipients["calvin"] for h in history)
+
+    def test_populate_keyword_response_count(self, keywords, smsin):
+        from django.core.cache import cache
+
+        cache.delete("keyword_{0}_num_resps".format(keywords["test"].pk))
+        populate_keyword_response_count()
+        assert cache.get("keyword_{0}_num_resps".format(keywords["test"].pk)) == 2
+        assert cache.get("keyword_{0}_num_arch_resps".format(keywords["test"].pk)) == 1
+
     @twilio_vcr
     def test_check_log_consistent(self):
         check_incoming_log()
@@ -72,6 +164,29 @@ class TestTasks:
 
         assert SmsInbound.objects.filter(content="New test message").count() == 1
 
+    @twilio_vcr
+    def test_log_msg_in_already_imported(self, recipients):
+        calvin = recipients["calvin"]
+        SmsInbound.objects.create(sid="thisisreallyauuid", content="", time_received=timezone.now())
+        p = {"Body": "New test message", "MessageSid": "thisisreallyauuid", "From": calvin.number}
+        log_msg_in(p, timezone.now(), calvin.pk)
+
+        sms = SmsInbound.objects.get(sid="thisisreallyauuid")
+        assert (sms.content, sms.sender_name) == ("New test message", "John Calvin")
+
+    def test_process_inbound_isolates_steps(self, recipients, monkeypatch):
+        def fail(*args):
+            raise Exception("Slack is down")
+
+        monkeypatch.setattr("apostello.tasks.sms_to_slack", fail)
+        calvin = recipients["calvin"]
+        p = {"Body": "New test message", "MessageSid": "thisisreallyauuid", "From": calvin.number}
+        contact = {"pk": calvin.pk, "name": str(calvin), "number": str(calvin.number), "is_blocking": False}
+        process_inbound(p, timezone.now(), contact, "No Match", False)
+        sms = SmsInbound.objects.get(sid="thisisreallyauuid")
+        assert sms.sender_name == "John Calvin"
+        assert sms.matched_colour == "#B6B6B6"
+
     def test_warn_on_blacklist_receipt(self, recipients):
         blacklist_notify(recipients["wesley"].pk, "stop it", "stop")
 
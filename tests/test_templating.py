@@ -0,0 +1,37 @@
+import pytest
+
+from apostello.templating import Template, compile_template, render
+
+
+class TestTemplate:
+    def test_render(self):
+        t = Template("Hi %name% %last_name%, thanks for texting %keyword% to %group%!")
+        assert (
+            t.render(name="John", last_name="Calvin", keyword="test", group="Church")
+            == "Hi John Calvin, thanks for texting test to Church!"
+        )
+
+    def test_missing_values_left_alone(self):
+        assert render("%name% %keyword% 100%", keyword="test") == "%name% test 100%"
+
+    def test_static(self):
+        t = Template("no placeholders here")
+        assert t.names == ()
+        assert t.render(name="John") == "no placeholders here"
+
+    def test_repeated_placeholder(self):
+        assert render("%name%%name%", name="ab") == "abab"
+
+    def test_length(self):
+        t = Template("Hi %name%!")
+        assert t.length(name="John") == len(t.render(name="John")) == 8
+
+    def test_compiled_once(self):
+        assert compile_template("Hi %name%") is compile_template("Hi %name%")
+
+    def test_segments(self):
+        t = Template("%name% " + "a" * 150)
+        assert t.segment_count(name="John") == 1
+        # a name outside the GSM character set switches the whole message to UCS-2:
+        assert t.segment_count(name="Jöhn") == 1
+        assert t.segment_count(name="Иван") == 3
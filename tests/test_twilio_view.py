@@ -1,3 +1,4 @@
+import uuid
 from urllib.parse import urljoin
 
 import pytest
@@ -7,8 +8,9 @@ from django.test import RequestFactory
 from tests.conftest import twilio_vcr
 from twilio.request_validator import RequestValidator
 
-from apostello import tasks
+from apostello import metrics, tasks
 from apostello.models import *
+from apostello.twilio import get_request_validator
 from apostello.views import *
 from site_config.models import SiteConfiguration
 
@@ -49,14 +51,16 @@ uri = "/sms/"
 
 
 def test_request_data():
+    # Twilio's retries are spotted by the message sid, so every message needs a new one:
+    sid = "SM" + uuid.uuid4().hex
     return {
         "ToCountry": "GB",
         "ToState": "Prudhoe",
-        "SmsMessageSid": "SMaddde4b15454abd70fa726b9fab1b6ed",
+        "SmsMessageSid": sid,
         "NumMedia": "0",
         "ToCity": "---",
         "FromZip": "---",
-        "SmsSid": "SMaddde4b15454abd70fa726b9fab1b6ed",
+        "SmsSid": sid,
         "FromState": "---",
         "SmsStatus": "received",
         "FromCity": "---",
@@ -64,7 +68,7 @@ def test_request_data():
         "FromCountry": "GB",
         "To": "+441661312031",
         "ToZip": "---",
-        "MessageSid": "SMaddde4b15454abd70fa726b9fab1b6ed",
+        "MessageSid": sid,
         "AccountSid": "AC37da8c50f65fe69a83a25579e578d4cd",
         "From": "+447927401749",
         "ApiVersion": "2010-04-01",
@@ -137,6 +141,67 @@ def test_twilio_view_unknown_contact(keywords, recipients):
     assert "Thanks new person!" in str(resp.content)
 
 
+@pytest.mark.slow
+@pytest.mark.django_db
+@twilio_vcr
+def test_twilio_view_fast_path(keywords, recipients, groups, settings):
+    settings.SMS_FAST_PATH = True
+    config = SiteConfiguration.get_solo()
+    config.disable_all_replies = False
+    config.save()
+    keywords["test"].linked_groups.add(groups["empty_group"])
+    num_requests = metrics.summary("sms_webhook")["count"]
+    factory = TwilioRequestFactory(token=get_token())
+    data = test_request_data_unknown()
+    data["Body"] = "Test"
+    resp = sms(factory.post(uri, data=data))
+    assert "Thanks new person!" in str(resp.content)
+    # contact is created and added to the group in the background:
+    contact = Recipient.objects.get(number=data["From"])
+    assert list(contact.groups.all()) == [groups["empty_group"]]
+    assert SmsInbound.objects.get(sid=data["MessageSid"]).sender_name == "Unknown Person"
+    assert metrics.summary("sms_webhook")["count"] == num_requests + 1
+
+
+@pytest.mark.slow
+@pytest.mark.django_db
+@twilio_vcr
+def test_twilio_view_retry(keywords, recipients, groups):
+    config = SiteConfiguration.get_solo()
+    config.disable_all_replies = False
+    config.save()
+    keywords["test"].linked_groups.add(groups["empty_group"])
+    factory = TwilioRequestFactory(token=get_token())
+    data = test_request_data()
+    data["Body"] = "Test"
+    first = sms(factory.post(uri, data=data))
+    groups["empty_group"].recipient_set.clear()
+    retry = sms(factory.post(uri, data=data))
+    assert "Test custom response with John" in str(retry.content)
+    assert retry.content == first.content
+    # the retry is not handled again:
+    assert groups["empty_group"].recipient_set.count() == 0
+    assert SmsInbound.objects.filter(sid=data["MessageSid"]).count() == 1
+
+
+@pytest.mark.django_db
+@twilio_vcr
+def test_twilio_view_webhook_base_url(recipients, settings):
+    settings.TWILIO_WEBHOOK_BASE_URL = "https://sms.example.com"
+    factory = TwilioRequestFactory(token=get_token())
+    num_checks = metrics.summary("twilio_validation")["count"]
+    data = test_request_data_blocked()
+    assert sms(factory.post(uri, data=data)).status_code == 403
+    factory.base_url = "https://sms.example.com/"
+    assert sms(factory.post(uri, data=data)).status_code == 200
+    assert metrics.summary("twilio_validation")["count"] == num_checks + 2
+
+
+def test_request_validator_cached():
+    assert get_request_validator("token") is get_request_validator("token")
+    assert get_request_validator("token") is not get_request_validator("other token")
+
+
 @pytest.mark.slow
 @pytest.mark.django_db
 @twilio_vcr
@@ -15,6 +15,7 @@ StatusCode = namedtuple("StatusCode", "anon, user, staff")
     [
         ("/", StatusCode(302, 200, 200)),
         ("/api/v2/config/", StatusCode(403, 403, 200)),
+        ("/api/v2/metrics/", StatusCode(403, 403, 200)),
         ("/api/v2/elvanto/groups/", StatusCode(403, 403, 200)),
         ("/api/v2/groups/", StatusCode(403, 200, 200)),
         ("/api/v2/keywords/", StatusCode(403, 200, 200)),
@@ -24,6 +25,7 @@ StatusCode = namedtuple("StatusCode", "anon, user, staff")
         ("/api/v2/setup/", StatusCode(403, 403, 200)),
         ("/api/v2/sms/in/", StatusCode(403, 200, 200)),
         ("/api/v2/sms/out/", StatusCode(403, 200, 200)),
+        ("/api/v2/sms/wall/", StatusCode(403, 200, 200)),
         ("/api/v2/users/", StatusCode(403, 200, 200)),
         ("/api/v2/users/profiles/", StatusCode(403, 403, 200)),
         ("/config/first_run/", StatusCode(302, 302, 302)),
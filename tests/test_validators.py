@@ -95,6 +95,17 @@ class TestCharLimit:
         with pytest.raises(ValidationError):
             less_than_sms_char_limit("t %name%" * (s.sms_char_limit - settings.MAX_NAME_LENGTH + len("%name%")))
 
+    def test_extended_characters_count_twice(self):
+        """Test GSM extension characters use up two characters."""
+        s = SiteConfiguration.get_solo()
+        with pytest.raises(ValidationError):
+            less_than_sms_char_limit("€" * (s.sms_char_limit // 2 + 1))
+
+    def test_ucs2_segments_raise(self):
+        """Test a message that is under the limit, but needs more sms."""
+        with pytest.raises(ValidationError):
+            less_than_sms_char_limit("ü" * 60 + "☺" * 20)
+
 
 class TestStartswithPlus:
     def test_no_plus(self):
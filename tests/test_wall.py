@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.views import wall_changes
+from apostello.models import SmsInbound
+
+
+@pytest.mark.django_db
+class TestWallFeed:
+    """Test the live wall feed."""
+
+    def test_no_cursor(self, smsin, users):
+        SmsInbound.objects.filter(pk=smsin["sms1"].pk).update(display_on_wall=True)
+        resp = users["c_staff"].get("/api/v2/sms/wall/")
+        assert resp.status_code == 200
+        data = resp.json()
+        assert [m["pk"] for m in data["messages"]] == [smsin["sms1"].pk]
+        assert data["cursor"]
+
+    def test_only_changes_since_cursor(self, smsin, users):
+        SmsInbound.objects.all().update(updated_at=timezone.now() - timedelta(minutes=5))
+        cursor = users["c_staff"].get("/api/v2/sms/wall/").json()["cursor"]
+        sms = smsin["sms3"]
+        sms.display_on_wall = True
+        sms.save()
+        data = users["c_staff"].get("/api/v2/sms/wall/", {"since": cursor}).json()
+        assert [m["pk"] for m in data["messages"]] == [sms.pk]
+        assert data["messages"][0]["display_on_wall"]
+
+    def test_hidden_keyword(self, smsin, users):
+        SmsInbound.objects.all().update(display_on_wall=True)
+        data, _ = wall_changes(users["staff"])
+        assert len(data) == 2
+        data, _ = wall_changes(users["notstaff2"])
+        assert data == []
+
+    def test_more_changes_than_limit(self, smsin, users, settings):
+        settings.MAX_SMS_N = 2
+        settings.CURSOR_OVERLAP = timedelta(0)
+        start = timezone.now() - timedelta(minutes=5)
+        for n, sms in enumerate(SmsInbound.objects.order_by("pk")):
+            SmsInbound.objects.filter(pk=sms.pk).update(updated_at=start + timedelta(seconds=n))
+        first, cursor = wall_changes(users["staff"], start - timedelta(minutes=1))
+        assert len(first) == 2
+        rest, _ = wall_changes(users["staff"], parse_datetime(cursor))
+        seen = [m["pk"] for m in first + rest]
+        assert sorted(seen) == sorted(SmsInbound.objects.values_list("pk", flat=True))